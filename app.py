@@ -3,7 +3,12 @@ from __future__ import annotations
 import streamlit as st
 from PIL import Image
 
-from inference.api import load_model, predict_pil_ui, PredictConfig, INSTRUCTIONS
+from inference.api import load_model, predict_bytes_ui, PredictConfig, INSTRUCTIONS
+from inference.cache import PredictionCache
+from inference.preprocess import open_image
+
+# JPEG dari HP didecode langsung di skala kecil (cukup untuk preview + model)
+DISPLAY_SIZE = 768
 
 st.set_page_config(page_title="Trash Classifier MVP", page_icon="♻️", layout="centered")
 
@@ -18,6 +23,13 @@ def _load():
 
 model, labels, device = _load()
 
+# Streamlit rerun tiap interaksi widget -> frame yang sama tidak diprediksi ulang
+@st.cache_resource
+def _prediction_cache():
+    return PredictionCache(max_entries=256, ttl_s=3600)
+
+pred_cache = _prediction_cache()
+
 cfg = PredictConfig(
     confidence_threshold=0.60,
     margin_threshold=0.15,
@@ -27,16 +39,19 @@ cfg = PredictConfig(
 tab1, tab2 = st.tabs(["Upload Image", "Camera"])
 
 img: Image.Image | None = None
+img_bytes: bytes | None = None
 
 with tab1:
     f = st.file_uploader("Upload gambar (jpg/png)", type=["jpg", "jpeg", "png"])
     if f is not None:
-        img = Image.open(f).convert("RGB")
+        img_bytes = f.getvalue()
+        img = open_image(f, draft_size=DISPLAY_SIZE)
 
 with tab2:
     cam = st.camera_input("Ambil foto dari kamera")
     if cam is not None:
-        img = Image.open(cam).convert("RGB")
+        img_bytes = cam.getvalue()
+        img = open_image(cam, draft_size=DISPLAY_SIZE)
 
 if img is None:
     st.info("Masukkan gambar dulu ya (upload atau camera).")
@@ -45,7 +60,7 @@ if img is None:
 st.image(img, caption="Input image", use_container_width=True)
 
 if st.button("Predict", type="primary"):
-    out = predict_pil_ui(img, model, labels, device, cfg)
+    out = predict_bytes_ui(img_bytes, model, labels, device, cfg, cache=pred_cache)
 
     label = out["label"]
     conf = out["confidence"]
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import argparse
+import shutil
+import sys
+from pathlib import Path
+
+from src.ml.utils import load_json
+
+# python -m benchmarks.compare metrics/bench.json --baseline benchmarks/baseline.json
+# exit code 1 when any metric regressed by more than --tolerance
+# python -m benchmarks.compare metrics/bench.json --save-baseline   (accept current numbers)
+
+DEFAULT_BASELINE = Path("benchmarks/baseline.json")
+
+
+def compare(current: dict, baseline: dict, tolerance: float):
+    rows, regressions = [], []
+    cur_m, base_m = current["metrics"], baseline["metrics"]
+    for name in sorted(set(cur_m) | set(base_m)):
+        if name not in cur_m or name not in base_m:
+            rows.append((name, base_m.get(name, {}).get("value"), cur_m.get(name, {}).get("value"), None, "missing"))
+            continue
+        base, cur = base_m[name]["value"], cur_m[name]["value"]
+        higher = cur_m[name]["higher_is_better"]
+        change = (cur - base) / base if base else 0.0
+        worse = -change if higher else change  # > 0 means slower
+        status = "REGRESSION" if worse > tolerance else ("improved" if worse < -tolerance else "ok")
+        if status == "REGRESSION":
+            regressions.append(name)
+        rows.append((name, base, cur, change, status))
+    return rows, regressions
+
+
+def _fmt(v) -> str:
+    return f"{v:10.2f}" if v is not None else f"{'-':>10s}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a stored baseline.")
+    parser.add_argument("results", type=Path)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (0.10 = 10%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="store `results` as the new baseline")
+    args = parser.parse_args()
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(args.results, args.baseline)
+        print("Saved baseline:", args.baseline)
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; create one with --save-baseline")
+        raise SystemExit(2)
+
+    current, baseline = load_json(args.results), load_json(args.baseline)
+    if current["meta"].get("platform") != baseline["meta"].get("platform"):
+        print("Warning: results come from a different platform than the baseline")
+
+    rows, regressions = compare(current, baseline, args.tolerance)
+    print(f"{'metric':45s} {'baseline':>10s} {'current':>10s} {'change':>8s}  status")
+    for name, base, cur, change, status in rows:
+        ch = f"{change * 100:+7.1f}%" if change is not None else f"{'-':>8s}"
+        print(f"{name:45s} {_fmt(base)} {_fmt(cur)} {ch}  {status}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
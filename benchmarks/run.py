@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data import DataLoader, TensorDataset
+
+from inference.api import PredictConfig, load_model, predict_batch_ui, predict_pil_ui
+from src.ml.config import Config
+from src.ml.dataset import Sample, TrashDataset, build_transforms
+from src.ml.model import create_model
+from src.ml.train import train_one_epoch
+from src.ml.utils import save_json
+
+# Speed benchmarks on synthetic data (no dataset or trained weights needed):
+#   python -m benchmarks.run --out metrics/bench.json
+#   python -m benchmarks.compare metrics/bench.json --baseline benchmarks/baseline.json
+
+Metrics = Dict[str, Dict[str, Any]]
+
+
+def _metric(metrics: Metrics, name: str, value: float, unit: str, higher_is_better: bool) -> None:
+    metrics[name] = {"value": float(value), "unit": unit, "higher_is_better": higher_is_better}
+    print(f"  {name:45s} {value:10.2f} {unit}")
+
+
+def _percentiles(times_ms: List[float]) -> Dict[str, float]:
+    return {f"p{q}": float(np.percentile(times_ms, q)) for q in (50, 90, 99)}
+
+
+def _synthetic_images(n: int, size=(640, 480), seed: int = 0) -> List[Image.Image]:
+    rng = np.random.default_rng(seed)
+    return [Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)) for _ in range(n)]
+
+
+def _write_artifacts(root: Path, classes) -> tuple[Path, Path]:
+    # random-init weights: timings don't depend on what the model learned
+    weights = root / "model.pth"
+    labels = root / "labels.json"
+    torch.save(create_model("resnet18", len(classes), pretrained=False).state_dict(), weights)
+    labels.write_text(json.dumps({"classes": list(classes)}), encoding="utf-8")
+    return weights, labels
+
+
+def bench_cold_start(metrics: Metrics, weights: Path, labels: Path, repeats: int) -> None:
+    # fresh interpreter each time: imports + weight load, what a new container pays
+    code = ("import time; t0 = time.perf_counter(); from inference.api import load_model; t1 = time.perf_counter(); "
+            f"load_model(r'{weights}', r'{labels}', device='cpu'); t2 = time.perf_counter(); "
+            "print(t1 - t0, t2 - t1)")
+    imports, loads = [], []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=Path(__file__).resolve().parent.parent)
+        a, b = map(float, out.stdout.strip().splitlines()[-1].split())
+        imports.append(a)
+        loads.append(b)
+    _metric(metrics, "cold_start.import_s", float(np.median(imports)), "s", False)
+    _metric(metrics, "cold_start.load_model_s", float(np.median(loads)), "s", False)
+
+
+def bench_latency(metrics: Metrics, model, labels, iters: int) -> None:
+    images = _synthetic_images(8)
+    cfg = PredictConfig()
+    for img in images[:3]:
+        predict_pil_ui(img, model, labels, "cpu", cfg)  # warm-up
+    times = []
+    for i in range(iters):
+        t0 = time.perf_counter()
+        predict_pil_ui(images[i % len(images)], model, labels, "cpu", cfg)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    for k, v in _percentiles(times).items():
+        _metric(metrics, f"predict_pil_ui.{k}_ms", v, "ms", False)
+
+
+def bench_batched(metrics: Metrics, model, labels, batch_sizes, thread_counts, rounds: int) -> None:
+    default_threads = torch.get_num_threads()
+    images = _synthetic_images(max(batch_sizes))
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for bs in batch_sizes:
+                cfg = PredictConfig(batch_size=bs)
+                batch = images[:bs]
+                predict_batch_ui(batch, model, labels, "cpu", cfg)  # warm-up
+                t0 = time.perf_counter()
+                for _ in range(rounds):
+                    predict_batch_ui(batch, model, labels, "cpu", cfg)
+                ips = bs * rounds / (time.perf_counter() - t0)
+                _metric(metrics, f"predict_batch_ui.bs{bs}.threads{threads}.ips", ips, "img/s", True)
+    finally:
+        torch.set_num_threads(default_threads)
+
+
+def bench_loader(metrics: Metrics, root: Path, n_images: int, worker_counts, image_size: int) -> None:
+    img_dir = root / "loader"
+    img_dir.mkdir(exist_ok=True)
+    samples = []
+    for i, img in enumerate(_synthetic_images(n_images, size=(512, 384), seed=1)):
+        p = img_dir / f"{i}.jpg"
+        img.save(p, quality=90)
+        samples.append(Sample(path=p, label_idx=i % 6))
+    train_tf, _ = build_transforms(image_size)
+    ds = TrashDataset(samples, transform=train_tf)
+    for workers in worker_counts:
+        loader = DataLoader(ds, batch_size=32, shuffle=True, num_workers=workers)
+        t0 = time.perf_counter()
+        n = sum(x.size(0) for x, _ in loader)
+        _metric(metrics, f"loader.workers{workers}.ips", n / (time.perf_counter() - t0), "img/s", True)
+
+
+def bench_train(metrics: Metrics, n_images: int, image_size: int, num_classes: int) -> None:
+    torch.manual_seed(0)
+    x = torch.randn(n_images, 3, image_size, image_size)
+    y = torch.randint(0, num_classes, (n_images,))
+    loader = DataLoader(TensorDataset(x, y), batch_size=32, shuffle=True)
+    model = create_model("resnet18", num_classes, pretrained=False)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    device = torch.device("cpu")
+    t0 = time.perf_counter()
+    train_one_epoch(model, loader, nn.CrossEntropyLoss(), optimizer, device)
+    _metric(metrics, "train_one_epoch.ips", n_images / (time.perf_counter() - t0), "img/s", True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference/training speed benchmarks on synthetic data.")
+    parser.add_argument("--out", type=Path, default=Path("metrics/bench.json"))
+    parser.add_argument("--quick", action="store_true", help="fewer iterations (smoke run)")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="subset of: cold_start latency batched loader train")
+    args = parser.parse_args()
+
+    cfg = Config()
+    quick = args.quick
+    cpu = os.cpu_count() or 1
+    only = set(args.only) if args.only else {"cold_start", "latency", "batched", "loader", "train"}
+
+    metrics: Metrics = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        weights, labels_path = _write_artifacts(root, cfg.classes)
+
+        if "cold_start" in only:
+            print("cold start")
+            bench_cold_start(metrics, weights, labels_path, repeats=1 if quick else 3)
+
+        if only & {"latency", "batched"}:
+            model, labels, _ = load_model(weights, labels_path, device="cpu")
+            if "latency" in only:
+                print("single-image latency")
+                bench_latency(metrics, model, labels, iters=10 if quick else 100)
+            if "batched" in only:
+                print("batched throughput")
+                threads = sorted({1, max(1, cpu // 2), cpu})
+                bench_batched(metrics, model, labels, [1, 8] if quick else [1, 8, 32], threads,
+                              rounds=2 if quick else 5)
+
+        if "loader" in only:
+            print("TrashDataset loader")
+            workers = sorted({0, min(2, cpu), min(4, cpu)})
+            bench_loader(metrics, root, 64 if quick else 512, workers, cfg.image_size)
+
+        if "train" in only:
+            print("train_one_epoch")
+            bench_train(metrics, 32 if quick else 256, cfg.image_size, len(cfg.classes))
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": cpu,
+            "torch_threads": torch.get_num_threads(),
+            "quick": quick,
+        },
+        "metrics": metrics,
+    }
+    save_json(args.out, result)
+    print("Saved:", args.out)
+
+
+if __name__ == "__main__":
+    main()
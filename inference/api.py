@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Sequence, Tuple
 
 import torch
 import torch.nn.functional as F
 from PIL import Image
-from torchvision import transforms
+
+from inference.cache import PredictionCache, content_digest, make_key, model_identity
+from inference.instrument import INSTRUMENTATION, NULL_TIMER, Histogram
+from inference.preprocess import ImageSource, get_transform, open_image, resize_to, to_input_tensor
+from src.ml.utils import autocast, maybe_compile, resolve_amp_dtype
 
 
 # --- Simple "decision layer" for waste handling (can be refined later) ---
@@ -26,15 +35,13 @@ class PredictConfig:
     confidence_threshold: float = 0.60     # below this -> needs_review
     margin_threshold: float = 0.15         # if top1-top2 small -> needs_review
     topk: int = 2
+    batch_size: int = 32                   # images per forward pass in predict_batch_ui
+    amp_dtype: str | None = None           # "bf16" / "fp16" autocast, fp32 if unsupported
+    channels_last: bool = False            # feed NHWC inputs (pair with load_model(channels_last=True))
 
 
 def _build_infer_transform(image_size: int = 224):
-    return transforms.Compose([
-        transforms.Resize((image_size, image_size)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=(0.485, 0.456, 0.406),
-                             std=(0.229, 0.224, 0.225)),
-    ])
+    return get_transform(image_size)  # cached per image_size
 
 
 def load_labels(labels_path: str | Path = "models/labels.json") -> list[str]:
@@ -46,69 +53,430 @@ def load_labels(labels_path: str | Path = "models/labels.json") -> list[str]:
 
 def load_model(weights_path: str | Path = "models/model.pth",
                labels_path: str | Path = "models/labels.json",
-               device: str | None = None):
-    from src.ml.model import create_model
+               device: str | None = None,
+               model_name: str = "resnet18",
+               channels_last: bool = False,
+               compile_mode: str | None = None,
+               image_size: int = 224,
+               backend: str = "auto"):
+    """Load a classifier behind a common `model(x) -> logits` interface.
+
+    backend: "eager" (nn.Module from model.pth), "torchscript" (model.ts or an
+    INT8 artifact), "onnx" (model.onnx via ONNX Runtime) or "auto" (by file).
+    """
+    from src.ml.model import load_finetuned
+    from inference.backends import resolve_backend, load_torchscript, load_onnx
 
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
     labels = load_labels(labels_path)
-    model = create_model("resnet18", num_classes=len(labels))
-    state = torch.load(str(weights_path), map_location=device)
-    model.load_state_dict(state)
-    model.to(device)
-    model.eval()
+    backend, path = resolve_backend(weights_path, backend)
+
+    if backend != "eager":
+        loader = load_torchscript if backend == "torchscript" else load_onnx
+        model, device, meta = loader(path, device)
+        if meta.get("classes") and list(meta["classes"]) != labels:
+            raise ValueError(f"{path} was exported for classes {meta['classes']}, labels file has {labels}")
+        model.cache_identity = _artifact_identity(path, backend)
+        return model, labels, device
+
+    model = load_finetuned(model_name, len(labels), path, device=device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    if compile_mode:
+        example = torch.zeros(1, 3, image_size, image_size, device=device)
+        if channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        model = maybe_compile(model, compile_mode, example)
+    model.cache_identity = _artifact_identity(path, backend)
     return model, labels, device
 
 
+def _artifact_identity(path: Path, backend: str) -> str:
+    # what PredictionCache keys on: same file contents -> same predictions
+    mtime_ns, size = _file_stamp(path)
+    return f"{Path(path).resolve()}:{mtime_ns}:{size}:{backend}"
+
+
+# --- Process-wide model registry (for callers outside st.cache_resource) ---
+MODEL_CACHE_SIZE = 4  # max loaded checkpoints kept alive (LRU)
+
+_model_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+
+def _file_stamp(path: str | Path) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def get_model(weights_path: str | Path = "models/model.pth",
+              labels_path: str | Path = "models/labels.json",
+              device: str | None = None,
+              model_name: str = "resnet18",
+              channels_last: bool = False,
+              compile_mode: str | None = None,
+              backend: str = "auto"):
+    """Cached `load_model`: loads once per (weights, labels, device, model_name),
+    reloads when either file changes on disk, evicts least recently used."""
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    key = (str(Path(weights_path).resolve()), str(Path(labels_path).resolve()), device, model_name,
+           channels_last, compile_mode, backend)
+    # an explicit backend serves a sibling artifact (model.ts / model.onnx): re-exporting it must reload too
+    artifact = weights_path
+    if backend != "auto":
+        from inference.backends import resolve_backend
+        artifact = resolve_backend(weights_path, backend)[1]
+    stamp = (_file_stamp(weights_path), _file_stamp(artifact), _file_stamp(labels_path))
+
+    with _model_cache_lock:
+        entry = _model_cache.get(key)
+        if entry is not None and entry[0] == stamp:
+            _model_cache.move_to_end(key)
+            return entry[1]
+
+        # load under the lock so concurrent first calls don't load twice
+        loaded = load_model(weights_path, labels_path, device=device, model_name=model_name,
+                            channels_last=channels_last, compile_mode=compile_mode, backend=backend)
+        _model_cache[key] = (stamp, loaded)
+        _model_cache.move_to_end(key)
+        while len(_model_cache) > max(1, MODEL_CACHE_SIZE):
+            _model_cache.popitem(last=False)
+        return loaded
+
+
+def clear_model_cache() -> None:
+    with _model_cache_lock:
+        _model_cache.clear()
+
+
+# heuristic: common confusion pair in TrashNet
+CONFUSABLE_PAIRS = {("glass", "plastic"), ("plastic", "glass")}
+
+
+def _confusable_matrix(labels: list[str]) -> torch.Tensor:
+    # [C, C] lookup so the pair check is a single gather over the batch
+    idx = {name: i for i, name in enumerate(labels)}
+    mat = torch.zeros(len(labels), len(labels), dtype=torch.bool)
+    for a, b in CONFUSABLE_PAIRS:
+        if a in idx and b in idx:
+            mat[idx[a], idx[b]] = True
+    return mat
+
+
+def _postprocess(probs: torch.Tensor, labels: list[str], cfg: PredictConfig,
+                 timer=NULL_TIMER) -> List[Dict[str, Any]]:
+    """Turn a [N, C] probability batch into the per-image UI dicts."""
+    with timer.stage("postprocess"):
+        probs_l, vals_l, idx_l, margin_l, review_l = _decide(probs, labels, cfg)
+    with timer.stage("dict_build"):
+        return _build_dicts(probs_l, vals_l, idx_l, margin_l, review_l, labels)
+
+
+def decision_signals(probs: torch.Tensor, labels: list[str], topk: int):
+    """[N, C] probs -> (topk_vals, topk_idx, margin, pair_confusable), the inputs of needs_review.
+
+    Split out so offline tools (src/ml/eval.py threshold sweeps) apply exactly the UI rule.
+    """
+    k = min(topk, len(labels))
+    topk_vals, topk_idx = torch.topk(probs, k=k, dim=1)
+
+    conf1 = topk_vals[:, 0]
+    conf2 = topk_vals[:, 1] if k > 1 else torch.zeros_like(conf1)
+    margin = conf1 - conf2
+
+    if k > 1:
+        pair_confusable = _confusable_matrix(labels)[topk_idx[:, 0], topk_idx[:, 1]]
+    else:
+        pair_confusable = torch.zeros_like(conf1, dtype=torch.bool)
+    return topk_vals, topk_idx, margin, pair_confusable
+
+
+def needs_review_mask(conf1: torch.Tensor, margin: torch.Tensor, pair_confusable: torch.Tensor,
+                      cfg: PredictConfig) -> torch.Tensor:
+    return pair_confusable | (conf1 < cfg.confidence_threshold) | (margin < cfg.margin_threshold)
+
+
+def decide_from_probs(probs: torch.Tensor, labels: list[str], cfg: PredictConfig) -> List[Dict[str, Any]]:
+    """[N, C] probabilities (e.g. averaged over frames) -> the per-image UI dicts, same rule as predict."""
+    return _build_dicts(*_decide(probs, labels, cfg), labels)
+
+
+def _decide(probs: torch.Tensor, labels: list[str], cfg: PredictConfig):
+    probs = probs.detach().float().cpu()
+    topk_vals, topk_idx, margin, pair_confusable = decision_signals(probs, labels, cfg.topk)
+    needs_review = needs_review_mask(topk_vals[:, 0], margin, pair_confusable, cfg)
+
+    # single host conversion for the whole batch
+    probs_l = probs.tolist()
+    vals_l = topk_vals.tolist()
+    idx_l = topk_idx.tolist()
+    margin_l = margin.tolist()
+    review_l = needs_review.tolist()
+    return probs_l, vals_l, idx_l, margin_l, review_l
+
+
+def _build_dicts(probs_l, vals_l, idx_l, margin_l, review_l, labels: list[str]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for n in range(len(probs_l)):
+        top = [{"label": labels[i], "confidence": float(v)} for v, i in zip(vals_l[n], idx_l[n])]
+        label1 = top[0]["label"]
+        out.append({
+            "label": label1,
+            "confidence": top[0]["confidence"],
+            "top": top,                      # top2 list
+            "needs_review": bool(review_l[n]),
+            "margin": float(margin_l[n]),
+            "instruction": INSTRUCTIONS.get(label1, "Buang sesuai kategori yang benar."),
+            # full probs (optional, useful for debugging)
+            "probs": {labels[i]: float(probs_l[n][i]) for i in range(len(labels))}
+        })
+    return out
+
+
+def _forward(model, x: torch.Tensor, device: str, cfg: PredictConfig) -> torch.Tensor:
+    if cfg.channels_last:
+        x = x.contiguous(memory_format=torch.channels_last)
+    amp_dtype = resolve_amp_dtype(cfg.amp_dtype, torch.device(device).type)
+    with autocast(device, amp_dtype):
+        logits = model(x)
+    return logits.float()
+
+
+@torch.no_grad()
+def predict_batch_ui(images: Sequence[ImageSource],
+                     model,
+                     labels: list[str],
+                     device: str,
+                     cfg: PredictConfig = PredictConfig()) -> List[Dict[str, Any]]:
+    """Classify many images with one forward pass per `cfg.batch_size` chunk."""
+    batch_size = max(1, cfg.batch_size)
+    results: List[Dict[str, Any]] = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        timer = INSTRUMENTATION.timer()
+        with timer.stage("decode"):
+            decoded = [open_image(item, draft_size=cfg.image_size) for item in chunk]
+        with timer.stage("preprocess"):
+            x = to_input_tensor([resize_to(img, cfg.image_size) for img in decoded])
+        out = _predict_tensor(x, model, labels, device, cfg, timer)
+        INSTRUMENTATION.finish(timer, out)
+        results.extend(out)
+    return results
+
+
+@torch.no_grad()
+def predict_tensor_ui(x: torch.Tensor,
+                      model,
+                      labels: list[str],
+                      device: str,
+                      cfg: PredictConfig = PredictConfig()) -> List[Dict[str, Any]]:
+    """Same output as predict_batch_ui for an already preprocessed [N, 3, H, W] batch."""
+    timer = INSTRUMENTATION.timer()
+    out = _predict_tensor(x, model, labels, device, cfg, timer)
+    INSTRUMENTATION.finish(timer, out)
+    return out
+
+
+def _predict_tensor(x: torch.Tensor, model, labels: list[str], device: str, cfg: PredictConfig,
+                    timer) -> List[Dict[str, Any]]:
+    with timer.stage("h2d"):
+        x = x.to(device)
+        timer.sync(device)
+    with timer.stage("forward"):
+        logits = _forward(model, x, device, cfg)
+        timer.sync(device)
+    with timer.stage("postprocess"):
+        probs = F.softmax(logits, dim=1)  # tensor [N, C]
+    return _postprocess(probs, labels, cfg, timer)
+
+
 @torch.no_grad()
 def predict_pil_ui(img: Image.Image,
                    model,
                    labels: list[str],
                    device: str,
-                   cfg: PredictConfig = PredictConfig()) -> Dict[str, Any]:
-    tf = _build_infer_transform(cfg.image_size)
-    x = tf(img.convert("RGB")).unsqueeze(0).to(device)
-
-    logits = model(x)
-    probs = F.softmax(logits, dim=1).squeeze(0)  # tensor [C]
-    probs_cpu = probs.detach().cpu()
-
-    # top-k
-    topk_vals, topk_idx = torch.topk(probs_cpu, k=min(cfg.topk, len(labels)))
-    top: List[Dict[str, Any]] = []
-    for v, i in zip(topk_vals.tolist(), topk_idx.tolist()):
-        top.append({"label": labels[int(i)], "confidence": float(v)})
-
-    label1 = top[0]["label"]
-    conf1 = top[0]["confidence"]
-    conf2 = top[1]["confidence"] if len(top) > 1 else 0.0
-    margin = conf1 - conf2
+                   cfg: PredictConfig = PredictConfig(),
+                   cache: PredictionCache | None = None) -> Dict[str, Any]:
+    if cache is None:
+        return predict_batch_ui([img], model, labels, device, cfg)[0]
+    # pixels are already decoded here, so a hit only skips preprocess + forward
+    digest = content_digest(f"{img.mode}:{img.size}:".encode("utf-8") + img.tobytes())
+    return _cached(cache, digest, model, cfg, lambda: predict_batch_ui([img], model, labels, device, cfg)[0])
 
-    # heuristic: common confusion pair in TrashNet
-    confusable_pairs = {("glass", "plastic"), ("plastic", "glass")}
-    top2_pair = (label1, top[1]["label"]) if len(top) > 1 else None
-    pair_confusable = top2_pair in confusable_pairs
 
-    needs_review = pair_confusable or (conf1 < cfg.confidence_threshold) or (margin < cfg.margin_threshold)
+def predict_bytes_ui(data: bytes,
+                     model,
+                     labels: list[str],
+                     device: str,
+                     cfg: PredictConfig = PredictConfig(),
+                     cache: PredictionCache | None = None) -> Dict[str, Any]:
+    """Predict from encoded image bytes; with a cache, repeats skip decode and forward."""
+    if cache is None:
+        return predict_batch_ui([io.BytesIO(data)], model, labels, device, cfg)[0]
+    return _cached(cache, content_digest(data), model, cfg,
+                   lambda: predict_batch_ui([io.BytesIO(data)], model, labels, device, cfg)[0])
 
 
-    return {
-        "label": label1,
-        "confidence": conf1,
-        "top": top,                      # top2 list
-        "needs_review": bool(needs_review),
-        "margin": float(margin),
-        "instruction": INSTRUCTIONS.get(label1, "Buang sesuai kategori yang benar."),
-        # full probs (optional, useful for debugging)
-        "probs": {labels[i]: float(probs_cpu[i].item()) for i in range(len(labels))}
-    }
+def _cached(cache: PredictionCache, digest: str, model, cfg: PredictConfig, compute) -> Dict[str, Any]:
+    key = make_key(digest, model_identity(model), cfg)
+    out = cache.get(key)
+    if out is None:
+        out = compute()
+        cache.put(key, out)
+    return out
 
 
 def predict_path_ui(image_path: str | Path,
                     weights_path: str | Path = "models/model.pth",
                     labels_path: str | Path = "models/labels.json",
                     cfg: PredictConfig = PredictConfig()) -> Dict[str, Any]:
-    model, labels, device = load_model(weights_path, labels_path)
-    img = Image.open(image_path).convert("RGB")
-    return predict_pil_ui(img, model, labels, device, cfg)
+    model, labels, device = get_model(weights_path, labels_path)
+    return predict_batch_ui([image_path], model, labels, device, cfg)[0]
+
+
+# --- Confidence-gated cascade: cheap first stage, full model only when unsure ---
+
+@dataclass(frozen=True)
+class CascadeConfig:
+    first_image_size: int = 160            # first-stage input (the full model at low res, or a small backbone)
+    confidence_threshold: float = 0.80     # first stage answers only above this ...
+    margin_threshold: float = 0.30         # ... with at least this top1-top2 gap; confusable pairs always escalate
+
+
+class CascadePredictor:
+    """Runs `first_model` on every image and escalates the gated ones, batched, to `model`.
+
+    Without `first_model` the first stage is `model` itself at `cascade.first_image_size`.
+    Result dicts are the usual predict_batch_ui dicts plus "stage": "first" or "full".
+    """
+
+    STAGE_NAMES = ("first", "full")
+
+    def __init__(self, model, labels: list[str], device: str, cfg: PredictConfig = PredictConfig(),
+                 first_model=None, cascade: CascadeConfig = CascadeConfig()):
+        self.model = model
+        self.first_model = first_model if first_model is not None else model
+        self.labels = labels
+        self.device = device
+        self.cfg = cfg
+        self.cascade = cascade
+        # the gate is needs_review with the (stricter) cascade thresholds
+        self._gate_cfg = replace(cfg, confidence_threshold=cascade.confidence_threshold,
+                                 margin_threshold=cascade.margin_threshold)
+        self.cache_identity = (f"cascade:{model_identity(self.first_model)}|{model_identity(model)}|"
+                               f"{cascade.first_image_size}:{cascade.confidence_threshold}:{cascade.margin_threshold}")
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.images = 0
+            self.escalated = 0
+            self.stage_images = {s: 0 for s in self.STAGE_NAMES}
+            self.stage_latency = {s: Histogram() for s in self.STAGE_NAMES}  # seconds per batch
+
+    def _probs(self, model, x: torch.Tensor, timer) -> torch.Tensor:
+        with timer.stage("h2d"):
+            x = x.to(self.device)
+            timer.sync(self.device)
+        with timer.stage("forward"):
+            logits = _forward(model, x, self.device, self.cfg)
+            timer.sync(self.device)
+        with timer.stage("postprocess"):
+            return F.softmax(logits, dim=1).cpu()
+
+    @torch.no_grad()
+    def predict_batch(self, images: Sequence[ImageSource]) -> List[Dict[str, Any]]:
+        batch_size = max(1, self.cfg.batch_size)
+        results: List[Dict[str, Any]] = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            timer = INSTRUMENTATION.timer()
+            with timer.stage("decode"):
+                decoded = [open_image(item, draft_size=self.cfg.image_size) for item in chunk]
+
+            t0 = time.perf_counter()
+            with timer.stage("preprocess"):
+                x = to_input_tensor([resize_to(img, self.cascade.first_image_size) for img in decoded])
+            probs = self._probs(self.first_model, x, timer)
+            with timer.stage("postprocess"):
+                topk_vals, _, margin, pair = decision_signals(probs, self.labels, self.cfg.topk)
+                escalate = needs_review_mask(topk_vals[:, 0], margin, pair, self._gate_cfg)
+            t1 = time.perf_counter()
+
+            esc_idx = escalate.nonzero().flatten().tolist()
+            if esc_idx:
+                with timer.stage("preprocess"):
+                    x = to_input_tensor([resize_to(decoded[i], self.cfg.image_size) for i in esc_idx])
+                probs[esc_idx] = self._probs(self.model, x, timer)
+            t2 = time.perf_counter()
+
+            out = _postprocess(probs, self.labels, self.cfg, timer)
+            stages = escalate.tolist()
+            for r, esc in zip(out, stages):
+                r["stage"] = "full" if esc else "first"
+            INSTRUMENTATION.finish(timer, out)
+            results.extend(out)
+
+            with self._lock:
+                self.images += len(out)
+                self.escalated += len(esc_idx)
+                self.stage_images["first"] += len(out)
+                self.stage_latency["first"].observe(t1 - t0)
+                if esc_idx:
+                    self.stage_images["full"] += len(esc_idx)
+                    self.stage_latency["full"].observe(t2 - t1)
+        return results
+
+    def predict_pil(self, img: Image.Image) -> Dict[str, Any]:
+        return self.predict_batch([img])[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for s in self.STAGE_NAMES:
+                h, n = self.stage_latency[s], self.stage_images[s]
+                stages[s] = {"batches": h.count, "images": n,
+                             "mean_batch_ms": h.sum / h.count * 1000.0 if h.count else 0.0,
+                             "mean_image_ms": h.sum / n * 1000.0 if n else 0.0}
+            return {"images": self.images, "escalated": self.escalated,
+                    "escalation_rate": self.escalated / self.images if self.images else 0.0, "stages": stages}
+
+    def prometheus_lines(self) -> List[str]:
+        lines = ["# HELP trash_cascade_stage_seconds Cascade stage latency per batch.",
+                 "# TYPE trash_cascade_stage_seconds histogram"]
+        with self._lock:
+            for s in self.STAGE_NAMES:
+                h = self.stage_latency[s]
+                cumulative = 0
+                for le, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += c
+                    lines.append(f'trash_cascade_stage_seconds_bucket{{stage="{s}",le="{le}"}} {cumulative}')
+                lines.append(f'trash_cascade_stage_seconds_sum{{stage="{s}"}} {h.sum:.6f}')
+                lines.append(f'trash_cascade_stage_seconds_count{{stage="{s}"}} {h.count}')
+            lines += ["# TYPE trash_cascade_images_total counter",
+                      f"trash_cascade_images_total {self.images}",
+                      "# TYPE trash_cascade_escalated_total counter",
+                      f"trash_cascade_escalated_total {self.escalated}"]
+        return lines
+
+
+def load_cascade(weights_path: str | Path = "models/model.pth",
+                 labels_path: str | Path = "models/labels.json",
+                 first_weights_path: str | Path | None = None,
+                 device: str | None = None,
+                 cfg: PredictConfig = PredictConfig(),
+                 cascade: CascadeConfig = CascadeConfig(),
+                 backend: str = "auto") -> CascadePredictor:
+    """Cascade over cached models; e.g. first_weights_path="models/model_mobilenet_v3_small.pth"."""
+    model, labels, device = get_model(weights_path, labels_path, device=device, backend=backend)
+    first = None
+    if first_weights_path is not None:
+        first, first_labels, _ = get_model(first_weights_path, labels_path, device=device, backend=backend)
+        if list(first_labels) != list(labels):
+            raise ValueError(f"{first_weights_path} and {weights_path} disagree on the class list")
+    return CascadePredictor(model, labels, device, cfg, first_model=first, cascade=cascade)
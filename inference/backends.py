@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+import torch
+
+# name -> file suffix next to models/model.pth (written by `python -m src.ml.export`)
+BACKEND_SUFFIXES = {"eager": ".pth", "torchscript": ".ts", "onnx": ".onnx"}
+
+
+class OnnxRuntimeModel:
+    """Callable wrapper so an ONNX Runtime session looks like `model(x) -> logits`."""
+
+    def __init__(self, path: str | Path, providers: list[str] | None = None):
+        import onnxruntime as ort  # optional dependency
+
+        self.session = ort.InferenceSession(str(path), providers=providers or ["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        custom = self.session.get_modelmeta().custom_metadata_map
+        self.meta: Dict[str, Any] = json.loads(custom["meta.json"]) if "meta.json" in custom else {}
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.session.run(None, {self.input_name: x.detach().float().cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+    def eval(self) -> "OnnxRuntimeModel":
+        return self
+
+
+def onnxruntime_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_backend(weights_path: str | Path, backend: str = "auto") -> Tuple[str, Path]:
+    """Pick (backend, artifact path). "auto" goes by the file itself; an explicit
+    backend looks for its sibling artifact, e.g. model.pth -> model.ts, unless the
+    file already is one (model_int8.pt is a TorchScript archive)."""
+    from src.ml.model import is_torchscript_archive
+
+    path = Path(weights_path)
+    if backend == "auto":
+        if path.suffix == ".onnx":
+            return "onnx", path
+        if is_torchscript_archive(path):
+            return "torchscript", path
+        return "eager", path
+
+    if backend not in BACKEND_SUFFIXES:
+        raise ValueError(f"Unknown backend {backend!r}, expected auto/{'/'.join(BACKEND_SUFFIXES)}")
+    if backend == "onnx" and not onnxruntime_available():
+        raise ImportError("backend='onnx' needs `pip install onnxruntime`")
+
+    if backend == "torchscript" and path.exists() and is_torchscript_archive(path):
+        return backend, path
+    candidate = path if path.suffix == BACKEND_SUFFIXES[backend] else path.with_suffix(BACKEND_SUFFIXES[backend])
+    if not candidate.exists():
+        raise FileNotFoundError(f"No {backend} artifact at {candidate}. Run: python -m src.ml.export")
+    return backend, candidate
+
+
+def load_torchscript(path: Path, device: str):
+    from src.ml.model import read_archive_meta
+
+    meta = read_archive_meta(path)
+    if meta.get("quantized"):
+        device = "cpu"  # quantized kernels are CPU-only
+        torch.backends.quantized.engine = meta.get("engine", torch.backends.quantized.engine)
+    model = torch.jit.load(str(path), map_location=device)
+    model.eval()
+    return model, device, meta
+
+
+def load_onnx(path: Path, device: str):
+    providers = ["CPUExecutionProvider"]
+    if device.startswith("cuda"):
+        providers.insert(0, "CUDAExecutionProvider")
+    model = OnnxRuntimeModel(path, providers=providers)
+    # session takes host arrays; keep tensors on CPU in predict_*_ui
+    return model, "cpu", model.meta
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+import numpy as np
+
+from inference.api import PredictConfig, get_model, predict_tensor_ui
+from inference.cache import PredictionCache, content_digest, make_key, model_identity
+from inference.preprocess import load_resized, to_input_tensor
+
+# Bulk offline scoring:
+#   python -m inference.bulk data/archive/ --out scores.jsonl
+#   python -m inference.bulk "photos/**/*.jpg" --out scores.csv
+#   python -m inference.bulk manifest.jsonl --out scores.jsonl     (one {"path": ...} per line)
+# Re-running with the same --out skips paths already classified; failed paths are retried and
+# their old error records removed, so --out holds one record per path.
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def iter_sources(source: str) -> Iterator[str]:
+    p = Path(source)
+    if p.is_dir():
+        for f in sorted(p.rglob("*")):
+            if f.suffix.lower() in IMAGE_SUFFIXES:
+                yield str(f)
+    elif p.suffix == ".jsonl" and p.is_file():
+        with p.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = Path(json.loads(line)["path"])
+                yield str(item if item.is_absolute() else p.parent / item)
+    else:
+        yield from sorted(glob.glob(source, recursive=True))
+
+
+# --- resumable output ---
+
+def _truncate_partial_line(path: Path) -> None:
+    # a crash mid-write leaves a line without "\n"; drop it so appends stay valid
+    with path.open("rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+def load_done(out_path: Path, fmt: str) -> Set[str]:
+    # paths with a successful record; error records (decode / IO failures) are retried on resume
+    if not out_path.exists():
+        return set()
+    _truncate_partial_line(out_path)
+    done: Set[str] = set()
+    with out_path.open("r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                if not row.get("error"):
+                    done.add(row["path"])
+        else:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    if not rec.get("error"):
+                        done.add(rec["path"])
+    return done
+
+
+def drop_error_records(out_path: Path, fmt: str, paths: Set[str]) -> int:
+    """Rewrite `out_path` without the error records of `paths` (retried now), so every path keeps one record."""
+    if not out_path.exists():
+        return 0
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    dropped = 0
+    with out_path.open("r", encoding="utf-8", newline="") as src, tmp.open("w", encoding="utf-8", newline="") as dst:
+        if fmt == "csv":
+            reader = csv.DictReader(src)
+            if reader.fieldnames:
+                rows = csv.DictWriter(dst, fieldnames=reader.fieldnames)
+                rows.writeheader()
+                for row in reader:
+                    if row.get("error") and row["path"] in paths:
+                        dropped += 1
+                    else:
+                        rows.writerow(row)
+        else:
+            for line in src:
+                if line.strip():
+                    rec = json.loads(line)
+                    if rec.get("error") and rec["path"] in paths:
+                        dropped += 1
+                        continue
+                dst.write(line)
+    if dropped:
+        os.replace(tmp, out_path)
+    else:
+        tmp.unlink()
+    return dropped
+
+
+class ResultWriter:
+    def __init__(self, out_path: Path, fmt: str, labels: List[str]):
+        self.fmt = fmt
+        self.labels = labels
+        new_file = not out_path.exists() or out_path.stat().st_size == 0
+        self.f = out_path.open("a", encoding="utf-8", newline="")
+        self.columns = (["path", "label", "confidence", "needs_review", "margin", "instruction", "top"]
+                        + [f"prob_{c}" for c in labels] + ["error"])
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.f, fieldnames=self.columns)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        for rec in records:
+            if self.fmt == "csv":
+                row = {k: rec.get(k, "") for k in ("path", "label", "confidence", "needs_review",
+                                                   "margin", "instruction", "error")}
+                if "top" in rec:
+                    row["top"] = json.dumps(rec["top"])
+                for c, v in rec.get("probs", {}).items():
+                    row[f"prob_{c}"] = v
+                self.writer.writerow(row)
+            else:
+                self.f.write(json.dumps(rec) + "\n")
+        self.f.flush()  # every batch is durable before the next one starts
+
+    def close(self) -> None:
+        self.f.close()
+
+
+# --- decode stage (runs in worker processes) ---
+
+def _decode_worker(path: str, image_size: int) -> Tuple[str, str | None, np.ndarray | None, str | None, float]:
+    t0 = time.perf_counter()
+    try:
+        data = Path(path).read_bytes()
+        arr = np.asarray(load_resized(io.BytesIO(data), image_size), dtype=np.uint8)
+        return path, content_digest(data), arr, None, time.perf_counter() - t0
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}", time.perf_counter() - t0
+
+
+def _consume(pending: "queue.Queue[Future | None]", model, labels: List[str], device: str, cfg: PredictConfig,
+             cache: PredictionCache | None, model_id: str, batch_size: int, writer: ResultWriter,
+             timings: Dict[str, float], counts: Dict[str, int]) -> None:
+    """Batching loop: decoded arrays -> cache lookups -> forward -> writer, until the None sentinel."""
+    finished = False
+    while not finished:
+        batch_paths: List[str] = []
+        batch_keys: List[str | None] = []
+        batch_arrays: List[np.ndarray] = []
+        records: List[Dict[str, Any]] = []
+
+        tw = time.perf_counter()
+        while len(batch_arrays) < batch_size:
+            fut = pending.get()
+            if fut is None:
+                finished = True
+                break
+            path, digest, arr, err, dt = fut.result()
+            timings["decode_cpu"] += dt
+            if err is not None:
+                records.append({"path": path, "error": err})
+                counts["error"] += 1
+                continue
+            key = make_key(digest, model_id, cfg) if cache is not None else None
+            hit = cache.get(key) if cache is not None else None
+            if hit is not None:
+                records.append({"path": path, **hit})
+                counts["cached"] += 1
+            else:
+                batch_paths.append(path)
+                batch_keys.append(key)
+                batch_arrays.append(arr)
+        timings["decode_wait"] += time.perf_counter() - tw
+
+        if batch_arrays:
+            tf = time.perf_counter()
+            outs = predict_tensor_ui(to_input_tensor(batch_arrays), model, labels, device, cfg)
+            timings["forward"] += time.perf_counter() - tf
+            records.extend({"path": p, **o} for p, o in zip(batch_paths, outs))
+            counts["ok"] += len(outs)
+            if cache is not None:
+                for key, o in zip(batch_keys, outs):
+                    cache.put(key, o)
+
+        if records:
+            tw = time.perf_counter()
+            writer.write(records)
+            timings["write"] += time.perf_counter() - tw
+
+
+def run(source: str, out_path: Path, weights: Path, labels_path: Path, backend: str = "auto",
+        device: str | None = None, workers: int | None = None, batch_size: int = 64,
+        prefetch: int = 4, cfg: PredictConfig = PredictConfig(),
+        cache: PredictionCache | None = None) -> Dict[str, Any]:
+    fmt = "csv" if out_path.suffix.lower() == ".csv" else "jsonl"
+    timings = {"load": 0.0, "decode_cpu": 0.0, "decode_wait": 0.0, "forward": 0.0, "write": 0.0}
+
+    t0 = time.perf_counter()
+    model, labels, device = get_model(weights, labels_path, device=device, backend=backend)
+    model_id = model_identity(model)
+    timings["load"] = time.perf_counter() - t0
+
+    done = load_done(out_path, fmt)
+    todo = [p for p in iter_sources(source) if p not in done]
+    drop_error_records(out_path, fmt, done | set(todo))
+    print(f"{len(done)} already done, {len(todo)} to classify -> {out_path}")
+
+    writer = ResultWriter(out_path, fmt, labels)
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    # bounded hand-off between the submitting thread and the batching loop
+    pending: "queue.Queue[Future | None]" = queue.Queue(maxsize=prefetch * batch_size)
+
+    counts = {"ok": 0, "error": 0, "cached": 0}
+    t_start = time.perf_counter()
+    stop = threading.Event()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        def produce():
+            for p in todo:
+                if stop.is_set():
+                    return
+                pending.put(pool.submit(_decode_worker, p, cfg.image_size))
+            pending.put(None)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            _consume(pending, model, labels, device, cfg, cache, model_id, batch_size, writer, timings, counts)
+        finally:
+            # on a forward/write error the producer may be blocked on the full queue: stop and drain it
+            stop.set()
+            while producer.is_alive():
+                try:
+                    fut = pending.get_nowait()
+                except queue.Empty:
+                    producer.join(0.05)
+                    continue
+                if fut is not None:
+                    fut.cancel()
+            writer.close()
+    n_ok, n_err, n_cached = counts["ok"], counts["error"], counts["cached"]
+
+    elapsed = time.perf_counter() - t_start
+    stats = {
+        "classified": n_ok,
+        "from_cache": n_cached,
+        "errors": n_err,
+        "skipped_already_done": len(done),
+        "elapsed_s": elapsed,
+        "images_per_sec": (n_ok + n_cached) / elapsed if elapsed > 0 else 0.0,
+        "workers": workers,
+        "batch_size": batch_size,
+        "timings_s": timings,
+    }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk classification of a directory, glob or JSONL manifest.")
+    parser.add_argument("source", help="directory, glob pattern, or .jsonl manifest with a 'path' field")
+    parser.add_argument("--out", type=Path, required=True, help="results .jsonl or .csv (appended / resumed)")
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--labels", type=Path, default=Path("models/labels.json"))
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--workers", type=int, default=None, help="decode processes (default: cpu_count - 1)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--cache-db", type=Path, default=None,
+                        help="SQLite prediction cache shared across runs (identical files skip the forward pass)")
+    args = parser.parse_args()
+
+    cache = PredictionCache(max_entries=10_000, sqlite_path=args.cache_db) if args.cache_db else None
+    try:
+        stats = run(args.source, args.out, args.weights, args.labels, backend=args.backend, device=args.device,
+                    workers=args.workers, batch_size=args.batch_size, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    t = stats["timings_s"]
+    print(f"Done: {stats['classified']} images, {stats['from_cache']} from cache ({stats['errors']} errors) "
+          f"in {stats['elapsed_s']:.1f}s -> {stats['images_per_sec']:.1f} img/s")
+    print("Stage timings (s): " + ", ".join(f"{k}={v:.2f}" for k, v in t.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Prediction cache keyed by image content + model identity + PredictConfig.
+# Memory tier: LRU with optional TTL. Optional SQLite tier for batch jobs that
+# re-score the same files across runs.
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def make_key(digest: str, model_id: str, cfg: Any) -> str:
+    # repr of the frozen PredictConfig covers thresholds, topk, image_size, ...
+    h = hashlib.blake2b(digest_size=16)
+    for part in (digest, model_id, repr(cfg)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def model_identity(model) -> str:
+    # set by load_model (path + mtime + size + backend); falls back to the object itself
+    return getattr(model, "cache_identity", None) or f"object:{id(model)}"
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int = 1024, ttl_s: Optional[float] = None,
+                 sqlite_path: str | Path | None = None, disk_max_entries: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_max_entries = disk_max_entries
+        self._mem: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path is not None:
+            Path(sqlite_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(sqlite_path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions "
+                             "(key TEXT PRIMARY KEY, created REAL NOT NULL, result TEXT NOT NULL)")
+            self._db.commit()
+
+    def _fresh(self, created: float) -> bool:
+        return self.ttl_s is None or (time.time() - created) <= self.ttl_s
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if self._fresh(entry[0]):
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT created, result FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._fresh(row[0]):
+                    result = json.loads(row[1])
+                    self._remember(key, row[0], result)
+                    self.disk_hits += 1
+                    return copy.deepcopy(result)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, copy.deepcopy(result))
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions (key, created, result) VALUES (?, ?, ?)",
+                                 (key, now, json.dumps(result)))
+                self._puts += 1
+                if self.disk_max_entries and self._puts % 1000 == 0:
+                    self._prune_disk()
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, result: Dict[str, Any]) -> None:
+        self._mem[key] = (created, result)
+        self._mem.move_to_end(key)
+        while len(self._mem) > max(1, self.max_entries):
+            self._mem.popitem(last=False)
+
+    def _prune_disk(self) -> None:
+        self._db.execute("DELETE FROM predictions WHERE key NOT IN "
+                         "(SELECT key FROM predictions ORDER BY created DESC LIMIT ?)", (self.disk_max_entries,))
+        if self.ttl_s is not None:
+            self._db.execute("DELETE FROM predictions WHERE created < ?", (time.time() - self.ttl_s,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
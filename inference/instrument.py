@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+# Opt-in per-stage latency histograms + torch.profiler capture for the inference path.
+# Configure from the environment (no code changes needed in the serving process):
+#   TRASH_INSTRUMENT=1            record stage timings into histograms
+#   TRASH_INSTRUMENT_ATTACH=1     also add "timings_ms" to every result dict
+#   TRASH_PROFILE_REQUESTS=N      profile the next N predict calls with torch.profiler
+#   TRASH_PROFILE_DIR=path        where trace files go (default metrics/traces)
+
+STAGES = ("server_decode", "decode", "preprocess", "h2d", "forward", "postprocess", "dict_build")
+BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_S):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class StageTimer:
+    """Collects the stage durations of one predict call."""
+
+    def __init__(self, owner: "Instrumentation", profiling: bool):
+        self.owner = owner
+        self.profiling = profiling
+        self.seconds: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        ctx = torch.profiler.record_function(name) if self.profiling else contextlib.nullcontext()
+        t0 = time.perf_counter()
+        with ctx:
+            yield
+        self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - t0
+
+    def sync(self, device) -> None:
+        # async CUDA work would otherwise be billed to whichever stage syncs next
+        if torch.device(device).type == "cuda":
+            torch.cuda.synchronize()
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {k: v * 1000.0 for k, v in self.seconds.items()}
+
+
+class _NullTimer:
+    """Disabled instrumentation: every hook is a no-op."""
+
+    profiling = False
+
+    def stage(self, name: str):
+        return contextlib.nullcontext()
+
+    def sync(self, device) -> None:
+        pass
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {}
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    def __init__(self, enabled: bool = False, attach: bool = False, profile_dir: str | Path = "metrics/traces"):
+        self.enabled = enabled
+        self.attach = attach
+        self.profile_dir = Path(profile_dir)
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.requests = 0
+        self.images = 0
+        self._profile_remaining = 0
+        self._profiler: Optional[torch.profiler.profile] = None
+        self.last_trace: Optional[Path] = None
+
+    @classmethod
+    def from_env(cls) -> "Instrumentation":
+        inst = cls(enabled=os.environ.get("TRASH_INSTRUMENT", "") == "1",
+                   attach=os.environ.get("TRASH_INSTRUMENT_ATTACH", "") == "1",
+                   profile_dir=os.environ.get("TRASH_PROFILE_DIR", "metrics/traces"))
+        n = int(os.environ.get("TRASH_PROFILE_REQUESTS", "0") or 0)
+        if n > 0:
+            inst.profile_next(n)
+        return inst
+
+    def enable(self, attach: bool = False) -> None:
+        self.enabled = True
+        self.attach = attach
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.attach = False
+
+    def profile_next(self, n: int, out_dir: str | Path | None = None) -> None:
+        """Capture the next `n` predict calls into one torch.profiler trace."""
+        with self._lock:
+            if out_dir is not None:
+                self.profile_dir = Path(out_dir)
+            self._profile_remaining = n
+
+    def timer(self):
+        if not self.enabled and self._profile_remaining <= 0:
+            return NULL_TIMER
+        with self._lock:
+            if self._profile_remaining > 0 and self._profiler is None:
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self._profiler = torch.profiler.profile(activities=activities)
+                self._profiler.start()
+            return StageTimer(self, profiling=self._profiler is not None)
+
+    def finish(self, timer, results: List[Dict]) -> None:
+        if timer is NULL_TIMER:
+            return
+        if self.attach:
+            for r in results:
+                r["timings_ms"] = timer.timings_ms()
+        with self._lock:
+            if self.enabled:
+                self.requests += 1
+                self.images += len(results)
+                for name, seconds in timer.seconds.items():
+                    self.histograms.setdefault(name, Histogram()).observe(seconds)
+            if self._profiler is not None and timer.profiling:
+                self._profile_remaining -= 1
+                if self._profile_remaining <= 0:
+                    self._stop_profiler()
+
+    def _stop_profiler(self) -> None:
+        prof, self._profiler = self._profiler, None
+        prof.stop()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        path = self.profile_dir / f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.json"
+        prof.export_chrome_trace(str(path))
+        self.last_trace = path
+        print(f"torch.profiler trace written to {path}")
+
+    def observe(self, name: str, seconds: float) -> None:
+        # for stages timed outside a predict call (e.g. the server's decode pool)
+        if self.enabled:
+            with self._lock:
+                self.histograms.setdefault(name, Histogram()).observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.requests = 0
+            self.images = 0
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP trash_inference_stage_seconds Latency of each inference stage per predict call.",
+            "# TYPE trash_inference_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self.histograms, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+                h = self.histograms[stage]
+                cumulative = 0
+                for le, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += c
+                    lines.append(f'trash_inference_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'trash_inference_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'trash_inference_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            lines += [
+                "# HELP trash_inference_requests_total Instrumented predict calls.",
+                "# TYPE trash_inference_requests_total counter",
+                f"trash_inference_requests_total {self.requests}",
+                "# HELP trash_inference_images_total Images classified by instrumented calls.",
+                "# TYPE trash_inference_images_total counter",
+                f"trash_inference_images_total {self.images}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+INSTRUMENTATION = Instrumentation.from_env()
@@ -6,14 +6,10 @@ from typing import Dict, Any
 import torch
 import torch.nn.functional as F
 from PIL import Image
-from torchvision import transforms
 
 def _build_infer_transform(image_size: int = 224):
-    return transforms.Compose([
-        transforms.Resize((image_size, image_size)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
-    ])
+    from inference.preprocess import get_transform
+    return get_transform(image_size)  # cached per image_size
 
 def load_labels(labels_path: str | Path = "models/labels.json") -> list[str]:
     import json
@@ -22,14 +18,10 @@ def load_labels(labels_path: str | Path = "models/labels.json") -> list[str]:
     return obj["classes"]
 
 def load_model(weights_path: str | Path = "models/model.pth", labels_path: str | Path = "models/labels.json", device: str = "cpu"):
-    from src.ml.model import create_model
+    from src.ml.model import load_finetuned
 
     labels = load_labels(labels_path)
-    model = create_model("resnet18", num_classes=len(labels))
-    state = torch.load(str(weights_path), map_location=device)
-    model.load_state_dict(state)
-    model.to(device)
-    model.eval()
+    model = load_finetuned("resnet18", len(labels), weights_path, device=device)
     return model, labels
 
 @torch.no_grad()
@@ -50,8 +42,10 @@ def predict_pil(img: Image.Image, model, labels: list[str], device: str = "cpu",
     }
 
 def predict_path(image_path: str | Path, weights_path: str | Path = "models/model.pth", labels_path: str | Path = "models/labels.json") -> Dict[str, Any]:
+    from inference.api import get_model
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, labels = load_model(weights_path, labels_path, device=device)
+    model, labels, _ = get_model(weights_path, labels_path, device=device)
     img = Image.open(image_path).convert("RGB")
     return predict_pil(img, model, labels, device=device)
 
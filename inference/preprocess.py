@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import functools
+import threading
+from pathlib import Path
+from typing import IO, Sequence
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# (x / 255 - mean) / std  ==  x * scale - shift, one multiply-add per element
+_SCALE = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(1, 3, 1, 1)
+_SHIFT = torch.tensor([m / s for m, s in zip(MEAN, STD)]).view(1, 3, 1, 1)
+
+ImageSource = Image.Image | str | Path | IO[bytes]
+
+
+@functools.lru_cache(maxsize=8)
+def get_transform(image_size: int = 224):
+    # cached torchvision equivalent of the fast path below (PIL -> normalized tensor)
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN, std=STD),
+    ])
+
+
+def open_image(src: ImageSource, draft_size: int | None = None) -> Image.Image:
+    """Open as RGB. For not-yet-decoded JPEGs, `draft` lets libjpeg decode at
+    1/2, 1/4 or 1/8 scale while staying >= draft_size on both sides."""
+    img = src if isinstance(src, Image.Image) else Image.open(src)
+    if draft_size and img.format == "JPEG":
+        img.draft("RGB", (draft_size, draft_size))  # no-op once pixels are loaded
+    return img.convert("RGB")
+
+
+def resize_to(img: Image.Image, image_size: int) -> Image.Image:
+    if img.size != (image_size, image_size):
+        img = img.resize((image_size, image_size), Image.BILINEAR)
+    return img
+
+
+def load_resized(src: ImageSource, image_size: int) -> Image.Image:
+    return resize_to(open_image(src, draft_size=image_size), image_size)
+
+
+_local = threading.local()
+
+
+def _buffer(n: int, h: int, w: int) -> torch.Tensor:
+    # one reusable float buffer per thread, grown on demand
+    buf = getattr(_local, "buf", None)
+    if buf is None or buf.numel() < n * 3 * h * w:
+        buf = torch.empty(n * 3 * h * w, dtype=torch.float32)
+        _local.buf = buf
+    return buf[: n * 3 * h * w].view(n, 3, h, w)
+
+
+def to_input_tensor(images: Sequence[Image.Image | np.ndarray], reuse_buffer: bool = True) -> torch.Tensor:
+    """uint8 HWC images (PIL or arrays, same size) -> normalized float [N, 3, H, W].
+
+    With reuse_buffer the result lives in a per-thread buffer and is only valid
+    until the next call on the same thread; pass False to keep it around.
+    """
+    u8 = torch.from_numpy(np.stack([np.asarray(img, dtype=np.uint8) for img in images]))
+    u8 = u8.permute(0, 3, 1, 2)  # view, no copy
+    n, _, h, w = u8.shape
+    out = _buffer(n, h, w) if reuse_buffer else torch.empty(n, 3, h, w)
+    torch.mul(u8, _SCALE, out=out)
+    return out.sub_(_SHIFT)
+
+
+def preprocess_batch(items: Sequence[ImageSource], image_size: int, reuse_buffer: bool = True) -> torch.Tensor:
+    return to_input_tensor([load_resized(item, image_size) for item in items], reuse_buffer=reuse_buffer)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import argparse
+import io
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import torch
+import torch.multiprocessing as mp
+
+from inference.api import PredictConfig, load_labels, load_model, predict_batch_ui
+
+# N worker processes, each with its own intra-op thread pool, serving one model
+# whose weights live in shared memory (eager backend), so RSS does not grow with N.
+#   with ReplicaPool("models/model.pth", "models/labels.json", replicas=8, threads_per_replica=4) as pool:
+#       results = pool.predict([Path("a.jpg"), jpeg_bytes, ...])
+#   python -m inference.replicas --tune data/trashnet/raw   (replicas x threads sweep)
+
+# bytes are encoded images; str/Path are files readable by the workers
+Item = bytes | str | Path
+
+
+def _as_source(item: Item):
+    return io.BytesIO(item) if isinstance(item, (bytes, bytearray)) else item
+
+
+def _worker(wid: int, model, labels: List[str], load_kwargs: Dict[str, Any] | None, threads: int,
+            cfg: PredictConfig, requests, results) -> None:
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:  # already set in this process
+        pass
+    if model is None:
+        # non-eager backends cannot share tensors; each replica loads its own copy
+        model, labels, device = load_model(**load_kwargs)
+    else:
+        device = "cpu"
+    results.put(("ready", wid, None, None))
+
+    while True:
+        msg = requests.get()
+        if msg is None:
+            break
+        req_id, items = msg
+        try:
+            out = predict_batch_ui([_as_source(it) for it in items], model, labels, device, cfg)
+            results.put(("ok", wid, req_id, out))
+        except Exception as e:
+            results.put(("error", wid, req_id, f"{type(e).__name__}: {e}"))
+
+
+class ReplicaPool:
+    def __init__(self, weights_path: str | Path = "models/model.pth",
+                 labels_path: str | Path = "models/labels.json",
+                 replicas: int | None = None, threads_per_replica: int | None = None,
+                 cfg: PredictConfig = PredictConfig(), backend: str = "eager",
+                 model_name: str = "resnet18", dispatch: str = "least_loaded"):
+        if dispatch not in ("least_loaded", "round_robin"):
+            raise ValueError(f"Unknown dispatch: {dispatch}")
+        cores = os.cpu_count() or 1
+        self.replicas = replicas or max(1, cores // (threads_per_replica or 1))
+        self.threads_per_replica = threads_per_replica or max(1, cores // self.replicas)
+        self.dispatch = dispatch
+        self.cfg = cfg
+
+        ctx = mp.get_context("spawn")
+        model, labels, load_kwargs = None, load_labels(labels_path), None
+        if backend == "eager":
+            model, labels, _ = load_model(weights_path, labels_path, device="cpu", model_name=model_name,
+                                          image_size=cfg.image_size, backend="eager")
+            model.share_memory()  # children map the same storages instead of copying
+        else:
+            load_kwargs = dict(weights_path=weights_path, labels_path=labels_path, device="cpu",
+                               model_name=model_name, image_size=cfg.image_size, backend=backend)
+        self.labels = labels
+
+        self._results = ctx.Queue()
+        self._queues = [ctx.Queue() for _ in range(self.replicas)]
+        self._procs = [ctx.Process(target=_worker, daemon=True,
+                                   args=(w, model, labels, load_kwargs, self.threads_per_replica, cfg,
+                                         self._queues[w], self._results))
+                       for w in range(self.replicas)]
+        for p in self._procs:
+            p.start()
+
+        self._lock = threading.Lock()
+        self._closing = False
+        self._inflight = [0] * self.replicas       # images queued per replica
+        self._pending: Dict[int, Tuple[int, int, Future]] = {}
+        self._ids = itertools.count()
+        self._rr = itertools.cycle(range(self.replicas))
+        self.completed = [0] * self.replicas
+        self.dead: Dict[int, int | None] = {}  # replica -> exit code, never routed to again
+
+        ready, deadline = 0, time.monotonic() + 300
+        while ready < self.replicas:
+            try:
+                kind, _, _, _ = self._results.get(timeout=1.0)
+            except queue.Empty:
+                crashed = [w for w, p in enumerate(self._procs) if not p.is_alive()]
+                if crashed or time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError(f"replicas {crashed} exited during startup" if crashed
+                                       else "replicas did not become ready within 300 s")
+                continue
+            if kind == "ready":
+                ready += 1
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _pick(self) -> int:
+        alive = [w for w in range(self.replicas) if w not in self.dead]
+        if not alive:
+            raise RuntimeError(f"all replicas died (exit codes {self.dead})")
+        if self.dispatch == "round_robin":
+            wid = next(self._rr)
+            while wid in self.dead:
+                wid = next(self._rr)
+            return wid
+        return min(alive, key=self._inflight.__getitem__)
+
+    def submit(self, items: Sequence[Item]) -> Future:
+        """Send one batch to a single replica; the future resolves to its result dicts."""
+        fut: Future = Future()
+        with self._lock:
+            self._reap_dead()
+            wid = self._pick()
+            req_id = next(self._ids)
+            self._inflight[wid] += len(items)
+            self._pending[req_id] = (wid, len(items), fut)
+        self._queues[wid].put((req_id, list(items)))
+        return fut
+
+    def predict(self, items: Sequence[Item], chunk_size: int | None = None) -> List[Dict[str, Any]]:
+        """Spread `items` over the replicas in chunks and return results in input order."""
+        chunk_size = chunk_size or max(1, min(self.cfg.batch_size, -(-len(items) // self.replicas)))
+        futures = [self.submit(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
+        out: List[Dict[str, Any]] = []
+        for f in futures:
+            out.extend(f.result())
+        return out
+
+    def _reap_dead(self) -> None:
+        # caller holds self._lock; a crashed replica (OOM kill, segfault) never answers its queue
+        for wid, p in enumerate(self._procs):
+            if wid in self.dead or p.is_alive():
+                continue
+            self.dead[wid] = p.exitcode
+            self._inflight[wid] = 0
+            for req_id, (w, _, fut) in list(self._pending.items()):
+                if w == wid:
+                    del self._pending[req_id]
+                    fut.set_exception(RuntimeError(f"replica {wid} died (exit code {p.exitcode})"))
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                msg = self._results.get(timeout=0.5)
+            except queue.Empty:
+                msg = ()
+            if msg is None:
+                break
+            with self._lock:
+                if not self._closing:
+                    self._reap_dead()
+            if not msg:
+                continue
+            kind, wid, req_id, payload = msg
+            with self._lock:
+                entry = self._pending.pop(req_id, None)
+                if entry is None:  # already failed by _reap_dead
+                    continue
+                _, n, fut = entry
+                self._inflight[wid] -= n
+                self.completed[wid] += n
+            if kind == "ok":
+                fut.set_result(payload)
+            else:
+                fut.set_exception(RuntimeError(f"replica {wid}: {payload}"))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"replicas": self.replicas, "threads_per_replica": self.threads_per_replica,
+                    "dispatch": self.dispatch, "inflight": list(self._inflight), "completed": list(self.completed),
+                    "dead": dict(self.dead)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+        for q in self._queues:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        self._results.put(None)
+        if hasattr(self, "_collector"):  # not yet started when startup fails
+            self._collector.join(timeout=5)
+
+    def __enter__(self) -> "ReplicaPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# --- replicas x threads tuning ---
+
+def candidate_splits(cores: int) -> List[Tuple[int, int]]:
+    # every (replicas, threads) that uses all cores exactly, from 1 x cores to cores x 1
+    return [(r, cores // r) for r in range(1, cores + 1) if cores % r == 0]
+
+
+def tune(items: Sequence[Item], weights_path: str | Path = "models/model.pth",
+         labels_path: str | Path = "models/labels.json", cores: int | None = None,
+         splits: Sequence[Tuple[int, int]] | None = None, cfg: PredictConfig = PredictConfig(),
+         rounds: int = 3) -> List[Dict[str, Any]]:
+    """Measure images/s for each replicas x threads split; best first."""
+    cores = cores or os.cpu_count() or 1
+    rows = []
+    for replicas, threads in splits or candidate_splits(cores):
+        with ReplicaPool(weights_path, labels_path, replicas=replicas, threads_per_replica=threads, cfg=cfg) as pool:
+            pool.predict(items[: replicas * cfg.batch_size])  # warm-up: first forward per replica
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                pool.predict(items)
+            elapsed = time.perf_counter() - t0
+        rows.append({"replicas": replicas, "threads_per_replica": threads,
+                     "images_per_sec": rounds * len(items) / elapsed})
+        print(f"replicas={replicas:3d} threads={threads:3d} -> {rows[-1]['images_per_sec']:.1f} img/s")
+    return sorted(rows, key=lambda r: -r["images_per_sec"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the replicas x threads split of the CPU replica pool.")
+    parser.add_argument("--tune", type=Path, required=True, help="directory of sample images")
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--labels", type=Path, default=Path("models/labels.json"))
+    parser.add_argument("--cores", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=PredictConfig.batch_size)
+    parser.add_argument("--limit", type=int, default=256, help="images per round")
+    parser.add_argument("--out", type=Path, default=Path("metrics/replicas_tuning.json"))
+    args = parser.parse_args()
+
+    files = sorted(p for p in args.tune.rglob("*") if p.suffix.lower() in {".jpg", ".jpeg", ".png"})[: args.limit]
+    if not files:
+        raise FileNotFoundError(f"No images under {args.tune}")
+    items = [p.read_bytes() for p in files]
+    rows = tune(items, args.weights, args.labels, cores=args.cores, cfg=PredictConfig(batch_size=args.batch_size))
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    best = rows[0]
+    print(f"Best: replicas={best['replicas']} threads_per_replica={best['threads_per_replica']} "
+          f"({best['images_per_sec']:.1f} img/s) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from PIL import Image
+
+from inference.api import CascadeConfig, PredictConfig, get_model, load_cascade, predict_batch_ui
+from inference.cache import PredictionCache, content_digest, make_key, model_identity
+from inference.instrument import INSTRUMENTATION
+from inference.preprocess import load_resized
+
+# Minimal asyncio HTTP/1.1 service (stdlib only):
+#   POST /predict   raw image body -> one result dict
+#                   multipart/form-data with N files -> {"results": [...]}
+#   GET  /healthz   process is up
+#   GET  /readyz    model loaded and queue has room
+#   GET  /metrics   Prometheus text; stage histograms when TRASH_INSTRUMENT=1 (see inference/instrument.py)
+# --cascade [--cascade-first small.pth] serves through api.CascadePredictor (stats also in /metrics).
+
+
+@dataclass(frozen=True)
+class ServerConfig:
+    host: str = "0.0.0.0"
+    port: int = 8000
+    max_batch_size: int = 16      # images per forward pass
+    max_wait_ms: float = 10.0     # how long the first request waits for company
+    max_queue: int = 256          # pending images before answering 503
+    max_body_mb: float = 20.0
+    decode_threads: int = 4
+    cache_size: int = 0           # identical uploads answered from PredictionCache (0 = off)
+    cache_ttl_s: float = 300.0
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches and runs them in one model thread."""
+
+    def __init__(self, predict_fn: Callable[[List[Image.Image]], List[Dict[str, Any]]],
+                 max_batch_size: int, max_wait_ms: float, max_queue: int):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        # single worker: the model is not shared between concurrent forward passes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self.batches = 0
+        self.images = 0
+
+    def has_room(self, n: int = 1) -> bool:
+        return self.queue.maxsize <= 0 or self.queue.qsize() + n <= self.queue.maxsize
+
+    async def submit(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        if not self.has_room(len(images)):
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for img in images:
+            fut = loop.create_future()
+            self.queue.put_nowait((img, fut))
+            futures.append(fut)
+        return list(await asyncio.gather(*futures))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = [img for img, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.predict_fn, images)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.images += len(batch)
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():  # client may have gone away
+                    fut.set_result(res)
+
+
+def _decode(data: bytes, image_size: int) -> Image.Image:
+    # reduced-scale JPEG decode straight to model input size
+    t0 = time.perf_counter()
+    img = load_resized(io.BytesIO(data), image_size)
+    INSTRUMENTATION.observe("server_decode", time.perf_counter() - t0)
+    return img
+
+
+def _split_multipart(content_type: str, body: bytes) -> List[Tuple[str, bytes]]:
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    parts = []
+    for part in msg.iter_parts():
+        payload = part.get_payload(decode=True)
+        if payload:
+            parts.append((part.get_filename() or part.get_param("name", header="content-disposition") or "", payload))
+    return parts
+
+
+class InferenceServer:
+    def __init__(self, cfg: ServerConfig, predict_cfg: PredictConfig, load_kwargs: Dict[str, Any],
+                 cascade: CascadeConfig | None = None, first_weights: Path | None = None):
+        self.cfg = cfg
+        self.predict_cfg = replace(predict_cfg, batch_size=cfg.max_batch_size)
+        self.load_kwargs = load_kwargs
+        self.cascade_cfg = cascade
+        self.first_weights = first_weights
+        self.cascade = None
+        self.decode_pool = ThreadPoolExecutor(max_workers=cfg.decode_threads, thread_name_prefix="decode")
+        self.batcher: MicroBatcher | None = None
+        self.ready = False
+        self.cache = PredictionCache(cfg.cache_size, ttl_s=cfg.cache_ttl_s) if cfg.cache_size > 0 else None
+        self.model_id = ""
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.cascade_cfg is not None:
+            self.cascade = await loop.run_in_executor(None, lambda: load_cascade(
+                first_weights_path=self.first_weights, cfg=self.predict_cfg, cascade=self.cascade_cfg,
+                **self.load_kwargs))
+            self.model_id = model_identity(self.cascade)
+            predict_fn = self.cascade.predict_batch
+        else:
+            model, labels, device = await loop.run_in_executor(None, lambda: get_model(**self.load_kwargs))
+            self.model_id = model_identity(model)
+
+            def predict_fn(images):
+                return predict_batch_ui(images, model, labels, device, self.predict_cfg)
+
+        self.batcher = MicroBatcher(predict_fn, self.cfg.max_batch_size, self.cfg.max_wait_ms, self.cfg.max_queue)
+        self._batcher_task = asyncio.create_task(self.batcher.run())
+        self.ready = True
+
+    # --- HTTP plumbing ---
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, payload, extra = await self._handle_request(reader)
+        except Exception as e:  # never let one bad client kill the connection handler
+            status, payload, extra = 500, {"error": f"{type(e).__name__}: {e}"}, {}
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head += [f"{k}: {v}" for k, v in extra.items()]
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return 400, {"error": "empty request"}, {}
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400, {"error": "malformed request line"}, {}
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        raw_length = headers.get("content-length")
+        if raw_length is None:
+            if method == "POST":
+                return 411, {"error": "Content-Length required"}, {}
+            raw_length = "0"
+        try:
+            length = int(raw_length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return 400, {"error": f"invalid Content-Length: {raw_length!r}"}, {}
+        if length > self.cfg.max_body_mb * 1024 * 1024:
+            return 413, {"error": f"body too large (max {self.cfg.max_body_mb:g} MB)"}, {}
+        try:
+            body = await reader.readexactly(length) if length else b""
+        except asyncio.IncompleteReadError:
+            return 400, {"error": "body shorter than Content-Length"}, {}
+
+        path = target.split("?", 1)[0]
+        if method == "GET" and path == "/healthz":
+            return 200, {"status": "ok"}, {}
+        if method == "GET" and path == "/readyz":
+            ok = self.ready and self.batcher is not None and self.batcher.has_room()
+            payload: Dict[str, Any] = {"ready": ok}
+            if self.batcher is not None:
+                payload.update(queued=self.batcher.queue.qsize(), batches=self.batcher.batches,
+                               images=self.batcher.images)
+            if self.cache is not None:
+                payload["cache"] = self.cache.stats()
+            return (200 if ok else 503), payload, {}
+        if method == "GET" and path == "/metrics":
+            return 200, self._metrics_text(), {}
+        if method == "POST" and path == "/predict":
+            return await self._predict(headers, body)
+        return 404, {"error": f"no route for {method} {path}"}, {}
+
+    def _metrics_text(self) -> str:
+        lines = [INSTRUMENTATION.prometheus_text().rstrip("\n")]
+        if self.batcher is not None:
+            lines += [
+                "# TYPE trash_server_queue_depth gauge",
+                f"trash_server_queue_depth {self.batcher.queue.qsize()}",
+                "# TYPE trash_server_batches_total counter",
+                f"trash_server_batches_total {self.batcher.batches}",
+                "# TYPE trash_server_images_total counter",
+                f"trash_server_images_total {self.batcher.images}",
+            ]
+        if self.cascade is not None:
+            lines += self.cascade.prometheus_lines()
+        if self.cache is not None:
+            stats = self.cache.stats()
+            lines += ["# TYPE trash_server_cache_hits_total counter",
+                      f"trash_server_cache_hits_total {stats['hits'] + stats['disk_hits']}",
+                      "# TYPE trash_server_cache_misses_total counter",
+                      f"trash_server_cache_misses_total {stats['misses']}"]
+        return "\n".join(lines) + "\n"
+
+    async def _predict(self, headers: Dict[str, str], body: bytes):
+        if not self.ready or self.batcher is None:
+            return 503, {"error": "model not loaded yet"}, {"Retry-After": "1"}
+        if not body:
+            return 400, {"error": "empty body; send image bytes or multipart/form-data"}, {}
+
+        content_type = headers.get("content-type", "")
+        multipart = content_type.startswith("multipart/")
+        parts = _split_multipart(content_type, body) if multipart else [("", body)]
+        if not parts:
+            return 400, {"error": "no files in multipart body"}, {}
+
+        results: List[Dict[str, Any] | None] = [None] * len(parts)
+        keys: List[str | None] = [None] * len(parts)
+        if self.cache is not None:
+            for i, (_, data) in enumerate(parts):
+                keys[i] = make_key(content_digest(data), self.model_id, self.predict_cfg)
+                results[i] = self.cache.get(keys[i])
+        todo = [i for i, r in enumerate(results) if r is None]
+
+        if todo:
+            loop = asyncio.get_running_loop()
+            try:
+                images = await asyncio.gather(*(loop.run_in_executor(self.decode_pool, _decode, parts[i][1],
+                                                                     self.predict_cfg.image_size)
+                                                 for i in todo))
+            except Exception as e:
+                return 400, {"error": f"cannot decode image: {e}"}, {}
+
+            try:
+                fresh = await self.batcher.submit(list(images))
+            except Overloaded:
+                return 503, {"error": "queue full, retry later"}, {"Retry-After": "1"}
+            for i, res in zip(todo, fresh):
+                results[i] = res
+                if self.cache is not None:
+                    self.cache.put(keys[i], res)
+
+        if not multipart:
+            return 200, results[0], {}
+        return 200, {"results": [dict(r, filename=name) for (name, _), r in zip(parts, results)]}, {}
+
+    async def serve_forever(self) -> None:
+        server = await asyncio.start_server(self.handle, self.cfg.host, self.cfg.port)
+        await self.start()
+        print(f"Serving on http://{self.cfg.host}:{self.cfg.port} "
+              f"(max_batch_size={self.cfg.max_batch_size}, max_wait_ms={self.cfg.max_wait_ms})")
+        async with server:
+            await server.serve_forever()
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 411: "Length Required", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP inference server with dynamic micro-batching.")
+    parser.add_argument("--host", default=ServerConfig.host)
+    parser.add_argument("--port", type=int, default=ServerConfig.port)
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--labels", type=Path, default=Path("models/labels.json"))
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--max-batch-size", type=int, default=ServerConfig.max_batch_size)
+    parser.add_argument("--max-wait-ms", type=float, default=ServerConfig.max_wait_ms)
+    parser.add_argument("--max-queue", type=int, default=ServerConfig.max_queue)
+    parser.add_argument("--cache-size", type=int, default=ServerConfig.cache_size)
+    parser.add_argument("--max-body-mb", type=float, default=ServerConfig.max_body_mb)
+    parser.add_argument("--cascade", action="store_true",
+                        help="answer confident images from a cheap first stage, escalate the rest")
+    parser.add_argument("--cascade-first", type=Path, default=None,
+                        help="first-stage weights (default: the same model at --cascade-size)")
+    parser.add_argument("--cascade-size", type=int, default=CascadeConfig.first_image_size)
+    args = parser.parse_args()
+
+    cfg = ServerConfig(host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                       max_wait_ms=args.max_wait_ms, max_queue=args.max_queue, cache_size=args.cache_size,
+                       max_body_mb=args.max_body_mb)
+    load_kwargs = dict(weights_path=args.weights, labels_path=args.labels, device=args.device, backend=args.backend)
+    cascade = None
+    if args.cascade or args.cascade_first is not None:
+        cascade = CascadeConfig(first_image_size=args.cascade_size)
+    asyncio.run(InferenceServer(cfg, PredictConfig(), load_kwargs, cascade=cascade,
+                                first_weights=args.cascade_first).serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+import numpy as np
+import torch
+from PIL import Image, ImageSequence
+
+from inference.api import CascadeConfig, PredictConfig, decide_from_probs, get_model, load_cascade, predict_batch_ui
+
+# Continuous classification of a video feed (conveyor camera):
+#   python -m inference.stream 0                          # camera device 0 (needs opencv-python)
+#   python -m inference.stream belt.mp4 --events ev.jsonl # recorded video, every frame (needs opencv-python)
+#   python -m inference.stream frames/ --fps 15           # folder of frames / glob / animated GIF (PIL only)
+#   add --realtime to replay a file at its frame rate, with live-camera frame dropping
+# capture thread -> bounded frame buffer -> near-duplicate skip -> batched predict -> window smoothing -> events
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+Frame = Tuple[int, float, np.ndarray]  # (index, capture time from perf_counter, RGB uint8 HxWx3)
+
+
+@dataclass(frozen=True)
+class StreamConfig:
+    batch_size: int = 8                       # frames per forward pass
+    max_wait_ms: float = 20.0                 # how long a partial batch waits for more frames
+    buffer_frames: int = 8                    # live sources drop the oldest frame beyond this
+    max_frame_age_ms: float | None = 500.0    # live sources: older frames are dropped unseen
+    dup_threshold: float = 0.01               # fraction of changed 32x32 thumbnail cells; below -> skip
+    dup_pixel_delta: float = 0.06             # a cell "changed" above this gray-level difference (0..1)
+    window: int = 5                           # classified frames averaged before deciding
+    emit: str = "change"                      # "change": on label/needs_review change, "every": every frame
+
+
+# --- frame sources (all yield RGB uint8 arrays) ---
+
+def opencv_available() -> bool:
+    try:
+        import cv2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _Pacer:
+    """Sleeps so frame i is released at start + i / fps (replaying a file like a camera)."""
+
+    def __init__(self, fps: float):
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.start = None
+        self.i = 0
+
+    def wait(self) -> None:
+        if self.start is None:
+            self.start = time.perf_counter()
+        delay = self.start + self.i * self.period - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.i += 1
+
+
+class VideoCaptureSource:
+    """Video file or camera device through OpenCV."""
+
+    def __init__(self, src: str | int, realtime: bool = False):
+        import cv2  # optional dependency
+
+        self.cap = cv2.VideoCapture(src)
+        if not self.cap.isOpened():
+            raise FileNotFoundError(f"Cannot open video source {src!r}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.live = isinstance(src, int) or realtime  # devices produce frames whether we keep up or not
+        self._pacer = _Pacer(self.fps) if realtime and not isinstance(src, int) else None
+        self._cvt = lambda f: cv2.cvtColor(f, cv2.COLOR_BGR2RGB)
+
+    def read(self) -> np.ndarray | None:
+        if self._pacer is not None:
+            self._pacer.wait()
+        ok, frame = self.cap.read()
+        return self._cvt(frame) if ok else None
+
+    def close(self) -> None:
+        self.cap.release()
+
+
+class ImageSequenceSource:
+    """Frames from a folder / glob of images or a multi-frame image (GIF, APNG, TIFF)."""
+
+    def __init__(self, spec: str | Path, fps: float = 15.0, realtime: bool = False):
+        p = Path(spec)
+        if p.is_dir():
+            self._frames = (Image.open(f) for f in sorted(p.iterdir()) if f.suffix.lower() in IMAGE_SUFFIXES)
+        elif p.is_file():
+            self._frames = ImageSequence.Iterator(Image.open(p))
+        else:
+            self._frames = (Image.open(f) for f in sorted(glob.glob(str(spec), recursive=True)))
+        self.fps = fps
+        self.live = realtime
+        self._pacer = _Pacer(fps) if realtime else None
+
+    def read(self) -> np.ndarray | None:
+        if self._pacer is not None:
+            self._pacer.wait()
+        img = next(self._frames, None)
+        return None if img is None else np.asarray(img.convert("RGB"))
+
+    def close(self) -> None:
+        pass
+
+
+def open_source(spec: str, fps: float | None = None, realtime: bool = False):
+    """"0" -> camera 0; image folders / globs / GIFs via PIL; anything else (mp4, rtsp://) via OpenCV."""
+    p = Path(spec)
+    if spec.isdigit():
+        if not opencv_available():
+            raise ImportError("camera input needs `pip install opencv-python`")
+        return VideoCaptureSource(int(spec))
+    if p.is_dir() or p.suffix.lower() in IMAGE_SUFFIXES | {".gif", ".tif", ".tiff"} or any(c in spec for c in "*?["):
+        return ImageSequenceSource(spec, fps=fps or 15.0, realtime=realtime)
+    if not opencv_available():
+        raise ImportError(f"reading {spec} needs `pip install opencv-python` (or pass a folder of frames)")
+    return VideoCaptureSource(spec, realtime=realtime)
+
+
+# --- capture buffer ---
+
+class FrameBuffer:
+    """Bounded hand-off between the capture thread and the model loop.
+
+    drop_oldest=True (live sources): a full buffer discards its oldest frame so the model
+    always sees recent frames. False (offline files): the capture thread waits instead.
+    """
+
+    def __init__(self, maxlen: int, drop_oldest: bool):
+        self.maxlen = max(1, maxlen)
+        self.drop_oldest = drop_oldest
+        self.frames: Deque[Frame] = deque()
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, frame: Frame) -> None:
+        with self._cond:
+            if self.drop_oldest:
+                if len(self.frames) >= self.maxlen:
+                    self.frames.popleft()
+                    self.dropped += 1
+            else:
+                while len(self.frames) >= self.maxlen and not self.closed:
+                    self._cond.wait()
+            self.frames.append(frame)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def get_batch(self, max_n: int, max_wait_s: float) -> List[Frame] | None:
+        """Up to max_n frames; waits for the first, then at most max_wait_s for the rest. None at end."""
+        with self._cond:
+            while not self.frames and not self.closed:
+                self._cond.wait()
+            if not self.frames:
+                return None
+            deadline = time.perf_counter() + max_wait_s
+            while len(self.frames) < max_n and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self.frames.popleft() for _ in range(min(max_n, len(self.frames)))]
+            self._cond.notify_all()
+            return batch
+
+
+def thumbnail(frame: np.ndarray, size: int = 32) -> np.ndarray:
+    # cheap perceptual signature: tiny grayscale box-filtered copy in [0, 1] (averages out sensor noise)
+    img = Image.fromarray(frame).convert("L").resize((size, size), Image.BOX)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def changed_fraction(a: np.ndarray, b: np.ndarray, pixel_delta: float) -> float:
+    # share of thumbnail cells that changed; a small object entering the frame still counts,
+    # unlike a whole-frame mean difference
+    return float((np.abs(a - b) > pixel_delta).mean())
+
+
+class StreamProcessor:
+    """Turns a frame source into smoothed label / needs_review events.
+
+    predict_fn: List[PIL.Image] -> result dicts with "probs" (predict_batch_ui or
+    CascadePredictor.predict_batch), so any model setup from inference/api.py plugs in.
+    """
+
+    def __init__(self, predict_fn: Callable[[List[Image.Image]], List[Dict[str, Any]]], labels: list[str],
+                 cfg: PredictConfig = PredictConfig(), stream: StreamConfig = StreamConfig()):
+        self.predict_fn = predict_fn
+        self.labels = labels
+        self.cfg = cfg
+        self.stream = stream
+        self.stop_event = threading.Event()
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self.captured = 0
+        self.dropped_buffer = 0
+        self.dropped_stale = 0
+        self.skipped_duplicate = 0
+        self.classified = 0
+        self.batches = 0
+        self.events = 0
+        self.latencies_ms: Deque[float] = deque(maxlen=10_000)
+        self.capture_error: BaseException | None = None
+        self.started = self.finished = None
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _capture(self, source, buffer: FrameBuffer, max_frames: int | None) -> None:
+        i = 0
+        try:
+            while not self.stop_event.is_set() and (max_frames is None or i < max_frames):
+                frame = source.read()
+                if frame is None:
+                    break
+                buffer.put((i, time.perf_counter(), frame))
+                i += 1
+        except BaseException as e:  # e.g. a corrupt frame; re-raised by run() instead of ending silently
+            self.capture_error = e
+        finally:
+            self.captured = i
+            buffer.close()
+
+    def run(self, source, max_frames: int | None = None) -> Iterator[Dict[str, Any]]:
+        """Yield events until the source ends (or stop()); stats() is final afterwards."""
+        s = self.stream
+        live = getattr(source, "live", False)
+        buffer = FrameBuffer(s.buffer_frames if live else max(s.buffer_frames, 2 * s.batch_size), drop_oldest=live)
+        self._reset_stats()
+        self.stop_event.clear()
+        capture = threading.Thread(target=self._capture, args=(source, buffer, max_frames), daemon=True)
+
+        window: Deque[torch.Tensor] = deque(maxlen=max(1, s.window))
+        last_thumb = None
+        last_state = None
+        last = None  # (probs, result) of the last classified frame; duplicates repeat it
+        self.started = time.perf_counter()
+        capture.start()
+        try:
+            while True:
+                batch = buffer.get_batch(s.batch_size, s.max_wait_ms / 1000.0)
+                if batch is None:
+                    break
+                now = time.perf_counter()
+                todo: List[Tuple[Frame, bool]] = []  # (frame, duplicate of the previous classified frame)
+                for item in batch:
+                    if live and s.max_frame_age_ms is not None and (now - item[1]) * 1000.0 > s.max_frame_age_ms:
+                        self.dropped_stale += 1
+                        continue
+                    thumb = thumbnail(item[2])
+                    dup = (last_thumb is not None
+                           and changed_fraction(thumb, last_thumb, s.dup_pixel_delta) < s.dup_threshold)
+                    if not dup:
+                        last_thumb = thumb
+                    todo.append((item, dup))
+                if not todo:
+                    continue
+
+                # only the forward pass is skipped for duplicates: they still count as "same result again"
+                fresh = [item for item, dup in todo if not dup]
+                results = iter(self.predict_fn([Image.fromarray(item[2]) for item in fresh]) if fresh else [])
+                if fresh:
+                    self.batches += 1
+                    self.classified += len(fresh)
+                for (idx, t_cap, _), dup in todo:
+                    if dup:
+                        self.skipped_duplicate += 1
+                    else:
+                        res = next(results)
+                        last = (torch.tensor([res["probs"][c] for c in self.labels]), res)
+                    probs, res = last
+                    window.append(probs)
+                    smoothed = torch.stack(list(window)).mean(dim=0, keepdim=True)
+                    event = decide_from_probs(smoothed, self.labels, self.cfg)[0]
+                    latency_ms = (time.perf_counter() - t_cap) * 1000.0
+                    self.latencies_ms.append(latency_ms)
+                    state = (event["label"], event["needs_review"])
+                    if s.emit == "every" or state != last_state:
+                        last_state = state
+                        self.events += 1
+                        event.update(frame=idx, latency_ms=latency_ms, frame_label=res["label"],
+                                     window=len(window), duplicate=dup)
+                        if "stage" in res:
+                            event["stage"] = res["stage"]
+                        yield event
+            if self.capture_error is not None:
+                raise RuntimeError(f"frame capture failed after {self.captured} frames") from self.capture_error
+        finally:
+            self.stop_event.set()
+            buffer.close()
+            capture.join(timeout=5)
+            self.dropped_buffer = buffer.dropped
+            self.finished = time.perf_counter()
+
+    def stats(self) -> Dict[str, Any]:
+        end = self.finished or time.perf_counter()
+        elapsed = max(end - (self.started or end), 1e-9)
+        handled = self.classified + self.skipped_duplicate
+        lat = np.asarray(self.latencies_ms, dtype=np.float64)
+        return {
+            "elapsed_s": elapsed,
+            "frames_captured": self.captured,
+            "dropped_buffer": self.dropped_buffer,
+            "dropped_stale": self.dropped_stale,
+            "skipped_duplicate": self.skipped_duplicate,
+            "classified": self.classified,
+            "batches": self.batches,
+            "events": self.events,
+            "capture_error": repr(self.capture_error) if self.capture_error is not None else None,
+            "fps_handled": handled / elapsed,          # frames the pipeline kept up with (classified + skipped)
+            "fps_classified": self.classified / elapsed,
+            "latency_ms": {  # capture -> smoothed decision, classified and duplicate frames
+                "mean": float(lat.mean()) if lat.size else 0.0,
+                "p50": float(np.percentile(lat, 50)) if lat.size else 0.0,
+                "p95": float(np.percentile(lat, 95)) if lat.size else 0.0,
+                "max": float(lat.max()) if lat.size else 0.0,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a video stream with frame skipping and smoothing.")
+    parser.add_argument("source", help="camera index, video file / URL, folder of frames, glob or GIF")
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--labels", type=Path, default=Path("models/labels.json"))
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--cascade-first", type=Path, default=None, help="small first-stage weights (cascade)")
+    parser.add_argument("--realtime", action="store_true", help="replay files at their frame rate, like a camera")
+    parser.add_argument("--fps", type=float, default=None, help="frame rate of image sequences")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=StreamConfig.batch_size)
+    parser.add_argument("--window", type=int, default=StreamConfig.window)
+    parser.add_argument("--dup-threshold", type=float, default=StreamConfig.dup_threshold,
+                        help="skip a frame when fewer than this fraction of thumbnail cells changed (0 = off)")
+    parser.add_argument("--emit", choices=["change", "every"], default=StreamConfig.emit)
+    parser.add_argument("--events", type=Path, default=None, help="write events as JSONL")
+    args = parser.parse_args()
+
+    stream = StreamConfig(batch_size=args.batch_size, window=args.window, dup_threshold=args.dup_threshold,
+                          emit=args.emit)
+    cfg = PredictConfig(batch_size=args.batch_size)
+    if args.cascade_first is not None:
+        cascade = load_cascade(args.weights, args.labels, first_weights_path=args.cascade_first, cfg=cfg,
+                               cascade=CascadeConfig(), backend=args.backend)
+        predict_fn, labels = cascade.predict_batch, cascade.labels
+    else:
+        model, labels, device = get_model(args.weights, args.labels, backend=args.backend)
+
+        def predict_fn(images):
+            return predict_batch_ui(images, model, labels, device, cfg)
+
+    proc = StreamProcessor(predict_fn, labels, cfg, stream)
+    source = open_source(args.source, fps=args.fps, realtime=args.realtime)
+    out = args.events.open("w", encoding="utf-8") if args.events else None
+    try:
+        for ev in proc.run(source, max_frames=args.max_frames):
+            flag = "  (needs review)" if ev["needs_review"] else ""
+            print(f"frame {ev['frame']:6d}: {ev['label']:10s} {ev['confidence']:.2f}{flag}  "
+                  f"[{ev['latency_ms']:.0f} ms]")
+            if out is not None:
+                out.write(json.dumps(ev) + "\n")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        if out is not None:
+            out.close()
+    print(json.dumps(proc.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
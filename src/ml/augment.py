@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import torch
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def _grayscale(x: torch.Tensor) -> torch.Tensor:
+    # x: float [N, 3, H, W] in [0, 1] -> [N, 1, H, W]
+    r, g, b = x.unbind(dim=-3)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(-3)
+
+def _rgb_to_hsv(x: torch.Tensor) -> torch.Tensor:
+    r, g, b = x.unbind(dim=-3)
+    maxc = x.max(dim=-3).values
+    minc = x.min(dim=-3).values
+    eqc = maxc == minc
+
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_divisor = torch.where(eqc, ones, cr)
+    rc = (maxc - r) / cr_divisor
+    gc = (maxc - g) / cr_divisor
+    bc = (maxc - b) / cr_divisor
+
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=-3)
+
+def _hsv_to_rgb(x: torch.Tensor) -> torch.Tensor:
+    h, s, v = x.unbind(dim=-3)
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.to(torch.int32) % 6
+
+    p = (v * (1.0 - s)).clamp(0.0, 1.0)
+    q = (v * (1.0 - s * f)).clamp(0.0, 1.0)
+    t = (v * (1.0 - s * (1.0 - f))).clamp(0.0, 1.0)
+
+    # pick one of the six hue sectors per pixel without Python branching
+    mask = i.unsqueeze(dim=-3) == torch.arange(6, device=i.device).view(-1, 1, 1)
+    a1 = torch.stack((v, q, p, p, t, v), dim=-3)
+    a2 = torch.stack((t, v, v, q, p, p), dim=-3)
+    a3 = torch.stack((p, p, t, v, v, q), dim=-3)
+    a4 = torch.stack((a1, a2, a3), dim=-4)
+    return torch.einsum("...ijk, ...xijk -> ...xjk", mask.to(dtype=x.dtype), a4)
+
+def _uniform(n: int, low: float, high: float, device) -> torch.Tensor:
+    return torch.empty(n, 1, 1, 1, device=device).uniform_(low, high)
+
+class BatchAugment:
+    """Tensor-op replacement for the per-sample train/eval transforms.
+
+    Takes a collated uint8 batch [N, 3, H, W] (already on the training device)
+    and returns the normalized float batch. Every sample draws its own flip and
+    jitter factors, like RandomHorizontalFlip + ColorJitter would.
+    """
+
+    def __init__(self, train: bool, flip_p: float = 0.5, brightness: float = 0.2,
+                 contrast: float = 0.2, saturation: float = 0.2, hue: float = 0.05,
+                 mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.train = train
+        self.flip_p = flip_p
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(std).view(1, 3, 1, 1)
+
+    @torch.no_grad()
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.float().div_(255.0)
+        if self.train:
+            x = self._augment(x)
+        mean = self.mean.to(x.device)
+        std = self.std.to(x.device)
+        return x.sub_(mean).div_(std)
+
+    def _augment(self, x: torch.Tensor) -> torch.Tensor:
+        n, device = x.size(0), x.device
+
+        if self.flip_p > 0:
+            flip = (torch.rand(n, device=device) < self.flip_p).view(n, 1, 1, 1)
+            x = torch.where(flip, x.flip(-1), x)
+
+        if self.brightness > 0:
+            b = _uniform(n, 1 - self.brightness, 1 + self.brightness, device)
+            x = (x * b).clamp_(0.0, 1.0)
+
+        if self.contrast > 0:
+            c = _uniform(n, 1 - self.contrast, 1 + self.contrast, device)
+            m = _grayscale(x).mean(dim=(-3, -2, -1), keepdim=True)
+            x = (c * x + (1 - c) * m).clamp_(0.0, 1.0)
+
+        if self.saturation > 0:
+            s = _uniform(n, 1 - self.saturation, 1 + self.saturation, device)
+            x = (s * x + (1 - s) * _grayscale(x)).clamp_(0.0, 1.0)
+
+        if self.hue > 0:
+            shift = _uniform(n, -self.hue, self.hue, device).squeeze(-1)  # [N, 1, 1]
+            hsv = _rgb_to_hsv(x)
+            h = torch.remainder(hsv[:, 0] + shift, 1.0)
+            x = _hsv_to_rgb(torch.stack((h, hsv[:, 1], hsv[:, 2]), dim=1))
+
+        return x
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import os
+import queue
+import random
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+# Full training checkpoints (model + optimizer + scaler + loop counters + RNG) written
+# by a background thread: the training thread only pays for a CPU copy of the state.
+
+CKPT_PATTERN = "ckpt_epoch*.pt"
+
+def capture_rng_state() -> Dict[str, Any]:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+def restore_rng_state(state: Dict[str, Any]) -> None:
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def snapshot(obj):
+    """Detached CPU copy of every tensor, so training can keep mutating the originals."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+def atomic_save(obj, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    torch.save(obj, tmp)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+def checkpoint_path(directory: Path, epoch: int) -> Path:
+    return directory / f"ckpt_epoch{epoch:04d}.pt"
+
+def list_checkpoints(directory: Path) -> List[Path]:
+    return sorted(Path(directory).glob(CKPT_PATTERN))
+
+def latest_checkpoint(directory: Path) -> Optional[Path]:
+    ckpts = list_checkpoints(directory)
+    return ckpts[-1] if ckpts else None
+
+def load_checkpoint(path: Path) -> Dict[str, Any]:
+    # RNG states contain numpy/python objects, so this is a full (trusted, local) unpickle
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+class CheckpointWriter:
+    """Serializes snapshots on a single background thread; keeps the newest `keep_last` checkpoints."""
+
+    def __init__(self, directory: Path, keep_last: int = 3):
+        self.directory = Path(directory)
+        self.keep_last = keep_last
+        self._queue: "queue.Queue[tuple[Path, Any, Callable[[], Any] | None] | None]" = queue.Queue(maxsize=2)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, obj, after = item
+            try:
+                atomic_save(obj, path)
+                if after is not None:
+                    after()  # e.g. the weights' architecture sidecar, only once the weights landed
+                if path.parent == self.directory and path.match(CKPT_PATTERN):
+                    self._prune()
+            except BaseException as e:  # surfaced on the next submit/close
+                self._error = e
+
+    def _prune(self) -> None:
+        if self.keep_last <= 0:
+            return
+        for old in list_checkpoints(self.directory)[:-self.keep_last]:
+            old.unlink(missing_ok=True)
+
+    def _raise_pending(self) -> None:
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError("checkpoint write failed") from err
+
+    def submit(self, path: Path, state, after: Callable[[], Any] | None = None) -> None:
+        """Queue `state` for an atomic write to `path`, then run `after` on the writer thread.
+
+        Blocks only if two writes are already pending.
+        """
+        self._raise_pending()
+        self._queue.put((Path(path), snapshot(state), after))
+
+    def save_epoch(self, epoch: int, state: Dict[str, Any]) -> Path:
+        path = checkpoint_path(self.directory, epoch)
+        self.submit(path, state)
+        return path
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_pending()
@@ -19,7 +19,8 @@ class Config:
 
     # Image/model
     image_size: int = 224
-    model_name: str = "resnet18"  # keep simple and fast
+    model_name: str = "resnet18"  # resnet18 / mobilenet_v3_small / shufflenet_v2_x1_0 / efficientnet_b0
+    weights_name: str = "model.pth"  # best weights -> output_dir / weights_name (+ .json architecture sidecar)
 
     # Train
     batch_size: int = 32
@@ -28,6 +29,47 @@ class Config:
     weight_decay: float = 1e-4
     num_workers: int = 2
 
+    # DataLoader / host-device transfer
+    pin_memory: bool = True            # only used when training on CUDA
+    non_blocking: bool = True          # async H2D copies (needs pinned memory to overlap)
+    persistent_workers: bool = True    # keep workers alive between epochs (num_workers > 0)
+    prefetch_factor: int = 2           # batches prefetched per worker (num_workers > 0)
+    log_every: int = 20                # steps between tqdm loss/acc refreshes (host sync)
+
+    # Preprocessed uint8 image cache (skips JPEG decode + resize every epoch)
+    use_image_cache: bool = False
+    cache_dir: Path = Path("data/trashnet/cache")
+
+    # Persisted sample index + stored splits (src/ml/index.py) instead of walking data_dir every run
+    use_sample_index: bool = False
+    sample_index_path: Path = Path("data/trashnet/cache/index.npz")
+
+    # "files": one image file per sample; "shards": stream packed tar shards (src/ml/shards.py)
+    data_format: str = "files"
+    shard_dir: Path = Path("data/trashnet/shards")
+    shard_size: int = 1000            # samples per shard
+    shuffle_buffer: int = 1000        # streaming shuffle window for the train split
+
+    # Collate uint8 batches and run flip/jitter/normalize as batched tensor ops on device
+    augment_on_device: bool = False
+
+    # Speed switches (each falls back to plain fp32/eager when unsupported)
+    amp_dtype: str | None = None      # "bf16" / "fp16" autocast
+    channels_last: bool = False       # NHWC memory format for model + inputs
+    compile_mode: str | None = None   # torch.compile mode, e.g. "default", "max-autotune"
+
+    # Distributed (torchrun); gloo runs on CPU-only nodes, nccl for multi-GPU
+    dist_backend: str = "gloo"
+
+    # Full training checkpoints for --resume (written in a background thread)
+    checkpoint_dir: Path = Path("models/checkpoints")
+    keep_checkpoints: int = 3          # newest N ckpt_epoch*.pt files kept (0 = keep all)
+
+    # Knowledge distillation: train model_name against soft targets of a trained teacher
+    distill_from: Path | None = None  # e.g. Path("models/model.pth")
+    distill_alpha: float = 0.7        # weight of the soft-target term (rest: hard-label CE)
+    distill_temperature: float = 4.0
+
     # Early stopping
     patience: int = 3
 
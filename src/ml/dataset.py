@@ -1,13 +1,18 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Tuple
 
+import numpy as np
 from PIL import Image
 import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
+from tqdm import tqdm
 
 @dataclass(frozen=True)
 class Sample:
@@ -29,6 +34,75 @@ class TrashDataset(Dataset):
             img = self.transform(img)
         return img, s.label_idx
 
+# --- Preprocessed image cache (decode + resize once, not every epoch) ---
+
+def _cache_fingerprint(samples: List[Sample], image_size: int) -> str:
+    h = hashlib.sha1(f"size={image_size}\n".encode("utf-8"))
+    for s in samples:
+        st = os.stat(s.path)
+        h.update(f"{s.path}\t{s.label_idx}\t{st.st_size}\t{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def build_image_cache(samples: List[Sample], cache_dir: Path, split: str, image_size: int) -> Path:
+    """Write `<split>.npy` (uint8 [N, H, W, 3]) + `<split>.json` index; reuse if still valid."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_path = cache_dir / f"{split}.json"
+    array_path = cache_dir / f"{split}.npy"
+
+    fingerprint = _cache_fingerprint(samples, image_size)
+    if index_path.exists() and array_path.exists():
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index.get("fingerprint") == fingerprint:
+            return index_path
+
+    tmp_path = cache_dir / f"{split}.tmp.npy"
+    arr = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                    shape=(len(samples), image_size, image_size, 3))
+    for i, s in enumerate(tqdm(samples, desc=f"cache {split}", leave=False)):
+        img = Image.open(s.path).convert("RGB").resize((image_size, image_size), Image.BILINEAR)
+        arr[i] = np.asarray(img, dtype=np.uint8)
+    arr.flush()
+    del arr
+    os.replace(tmp_path, array_path)
+
+    index = {
+        "fingerprint": fingerprint,
+        "image_size": image_size,
+        "array": array_path.name,
+        "paths": [str(s.path) for s in samples],
+        "labels": [s.label_idx for s in samples],
+    }
+    index_path.write_text(json.dumps(index), encoding="utf-8")
+    return index_path
+
+class CachedTrashDataset(Dataset):
+    """Reads resized uint8 images from a `build_image_cache` array (memory-mapped)."""
+
+    def __init__(self, index_path: Path, transform=None):
+        index = json.loads(Path(index_path).read_text(encoding="utf-8"))
+        self.array_path = Path(index_path).parent / index["array"]
+        self.labels = index["labels"]
+        self.transform = transform
+        self._images = None  # opened lazily, once per worker
+
+    def __getstate__(self):
+        # never pickle the memmap into spawned workers
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, int]:
+        if self._images is None:
+            # copy-on-write mapping: writable view for torch, file stays untouched
+            self._images = np.load(self.array_path, mmap_mode="c")
+        img = torch.from_numpy(self._images[idx]).permute(2, 0, 1)  # uint8 [3, H, W], no copy
+        if self.transform:
+            img = self.transform(img)
+        return img, self.labels[idx]
+
 def build_transforms(image_size: int):
     train_tf = transforms.Compose([
         transforms.Resize((image_size, image_size)),
@@ -43,3 +117,24 @@ def build_transforms(image_size: int):
         transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
     ])
     return train_tf, eval_tf
+
+def build_cached_transforms():
+    # inputs are already resized uint8 tensors from CachedTrashDataset
+    train_tf = transforms.Compose([
+        transforms.RandomHorizontalFlip(p=0.5),
+        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.05),
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+    ])
+    eval_tf = transforms.Compose([
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+    ])
+    return train_tf, eval_tf
+
+def build_uint8_transform(image_size: int):
+    # for Config.augment_on_device: workers only resize, BatchAugment does the rest
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.PILToTensor(),
+    ])
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import contextlib
+import os
+from dataclasses import dataclass
+from typing import Tuple
+
+import torch
+import torch.distributed as dist
+
+# Data-parallel training over processes/nodes, launched with torchrun:
+#   torchrun --nproc_per_node=4 -m src.ml.train
+#   torchrun --nnodes=2 --node_rank=0 --master_addr=10.0.0.1 --nproc_per_node=8 -m src.ml.train
+# Without torchrun's env (WORLD_SIZE unset or 1) everything here is a no-op.
+
+@dataclass(frozen=True)
+class DistInfo:
+    rank: int = 0
+    local_rank: int = 0
+    world_size: int = 1
+
+    @property
+    def enabled(self) -> bool:
+        return self.world_size > 1
+
+    @property
+    def is_main(self) -> bool:
+        return self.rank == 0
+
+def init_distributed(backend: str = "gloo") -> DistInfo:
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return DistInfo()
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return DistInfo(rank=dist.get_rank(), local_rank=int(os.environ.get("LOCAL_RANK", "0")),
+                    world_size=dist.get_world_size())
+
+def cleanup() -> None:
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+def is_main_process() -> bool:
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+@contextlib.contextmanager
+def main_process_first():
+    # e.g. building the image cache: rank 0 writes, the others reuse it afterwards
+    if dist.is_initialized() and not is_main_process():
+        dist.barrier()
+    yield
+    if dist.is_initialized() and is_main_process():
+        dist.barrier()
+
+def reduce_epoch_totals(total_loss: torch.Tensor, correct: torch.Tensor, n: int) -> Tuple[float, float]:
+    """(mean loss, accuracy) over all ranks from the per-rank running sums; one host sync."""
+    totals = torch.stack([total_loss.double(), correct.double(),
+                          torch.tensor(float(n), dtype=torch.float64, device=total_loss.device)])
+    if dist.is_initialized():
+        dist.all_reduce(totals, op=dist.ReduceOp.SUM)
+    loss_sum, correct_sum, count = totals.tolist()
+    return loss_sum / count, correct_sum / count
+
+def gather_objects(obj) -> list:
+    # picklable per-rank state (e.g. RNG) collected on every rank, in rank order
+    if not dist.is_initialized():
+        return [obj]
+    out = [None] * dist.get_world_size()
+    dist.all_gather_object(out, obj)
+    return out
+
+def broadcast_flag(flag: bool, device: torch.device | str = "cpu") -> bool:
+    # rank 0 decides (early stopping, ...) so every rank leaves the loop on the same epoch
+    if not dist.is_initialized():
+        return flag
+    t = torch.tensor([1 if flag else 0], dtype=torch.int32, device=device)
+    dist.broadcast(t, src=0)
+    return bool(t.item())
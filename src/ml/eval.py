@@ -1,62 +1,141 @@
 from __future__ import annotations
 
+import argparse
+import hashlib
+import time
 from pathlib import Path
-import json
+from typing import Any, Dict, List, Sequence, Tuple
 
 import numpy as np
 import torch
 from torch.utils.data import DataLoader
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report
 import matplotlib.pyplot as plt
 
+from inference.api import PredictConfig, decision_signals, needs_review_mask
 from .config import Config
-from .dataset import TrashDataset, build_transforms, Sample
-from .model import create_model
-from .utils import get_device, load_json, ensure_dir, save_json
-from .train import gather_samples, split_samples  # reuse
+from .model import load_finetuned, resolve_model_name
+from .utils import get_device, load_json, ensure_dir, save_json, autocast, resolve_amp_dtype
+from .train import load_splits, make_dataset, make_batch_transform, loader_kwargs  # reuse
 
-@torch.no_grad()
-def main():
-    cfg = Config()
-    device = get_device(cfg.device)
-    ensure_dir(cfg.metrics_dir)
+# One forward pass per (checkpoint, split), then everything from cached float16 logits:
+#   python -m src.ml.eval                                        # test split, models/model.pth
+#   python -m src.ml.eval --splits val test --weights a.pth b.pth
+# Logits live in metrics/logits/<checkpoint hash>_<split>.npy (+ _labels.npy, .json).
 
-    # Load labels
-    labels_path = Path("models/labels.json")
-    labels_obj = load_json(labels_path)
-    classes = labels_obj["classes"]
+SPLITS = ("train", "val", "test")
+CONF_GRID = np.round(np.arange(0.0, 1.0, 0.05), 2)
+MARGIN_GRID = np.round(np.arange(0.0, 0.55, 0.05), 2)
 
-    samples = gather_samples(cfg.data_dir, tuple(classes))
-    _, _, test_s = split_samples(samples, cfg.seed, cfg.train_ratio, cfg.val_ratio, cfg.test_ratio)
+def file_hash(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-    _, eval_tf = build_transforms(cfg.image_size)
-    test_ds = TrashDataset(test_s, transform=eval_tf)
-    test_loader = DataLoader(test_ds, batch_size=cfg.batch_size, shuffle=False, num_workers=cfg.num_workers)
+def _samples_fingerprint(samples) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for s in samples:
+        h.update(f"{s.path}\t{s.label_idx}\n".encode("utf-8"))
+    return h.hexdigest()
 
-    model = create_model(cfg.model_name, num_classes=len(classes)).to(device)
-    state = torch.load("models/model.pth", map_location=device)
-    model.load_state_dict(state)
-    model.eval()
+@torch.no_grad()
+def compute_logits(model, loader, device, cfg: Config, n: int,
+                   num_classes: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Forward the whole loader once into preallocated [N, C] float16 logits + [N] labels."""
+    amp_dtype = resolve_amp_dtype(cfg.amp_dtype, device.type)
+    batch_tf = make_batch_transform(cfg, train=False)
+    logits_out = None
+    labels_out = np.empty(n, dtype=np.int16)
+    i = 0
+    for x, y in loader:
+        x = x.to(device, non_blocking=cfg.non_blocking)
+        if batch_tf is not None:
+            x = batch_tf(x)
+        if cfg.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with autocast(device, amp_dtype):
+            logits = model(x)
+        if logits_out is None:
+            logits_out = np.empty((n, logits.shape[1]), dtype=np.float16)
+        b = y.shape[0]
+        logits_out[i:i + b] = logits.to(torch.float16).cpu().numpy()
+        labels_out[i:i + b] = y.numpy()
+        i += b
+    if logits_out is None:  # empty split
+        return np.empty((0, num_classes), dtype=np.float16), labels_out[:0]
+    return logits_out[:i], labels_out[:i]
+
+def load_cached_logits(logits_dir: Path, key: str, meta: Dict[str, Any]):
+    base = logits_dir / key
+    meta_path = base.with_suffix(".json")
+    if not meta_path.exists() or load_json(meta_path) != meta:
+        return None
+    return np.load(f"{base}.npy"), np.load(f"{base}_labels.npy")
+
+def save_cached_logits(logits_dir: Path, key: str, meta: Dict[str, Any], logits: np.ndarray, labels: np.ndarray):
+    ensure_dir(logits_dir)
+    base = logits_dir / key
+    np.save(f"{base}.npy", logits)
+    np.save(f"{base}_labels.npy", labels)
+    save_json(base.with_suffix(".json"), meta)  # written last: marks the pair as complete
 
-    y_true = []
-    y_pred = []
+def logits_meta(ckpt_hash: str, split: str, samples, classes: Sequence[str], model_name: str,
+                cfg: Config, device, backend: str = "eager") -> Dict[str, Any]:
+    # everything that changes the logits; the weights path itself doesn't (same bytes, same cache)
+    amp_dtype = resolve_amp_dtype(cfg.amp_dtype, torch.device(device).type)  # None where autocast falls back
+    return {"checkpoint_hash": ckpt_hash, "split": split, "samples": _samples_fingerprint(samples),
+            "classes": list(classes), "model_name": model_name, "image_size": cfg.image_size,
+            "backend": backend, "amp_dtype": str(amp_dtype) if amp_dtype is not None else None,
+            "channels_last": cfg.channels_last, "data_format": cfg.data_format,
+            "use_image_cache": cfg.use_image_cache, "augment_on_device": cfg.augment_on_device}
 
-    for x, y in test_loader:
-        x = x.to(device)
-        logits = model(x)
-        preds = torch.argmax(logits, dim=1).cpu().numpy()
-        y_pred.extend(preds.tolist())
-        y_true.extend(y.numpy().tolist())
+def confusion(y: np.ndarray, pred: np.ndarray, num_classes: int) -> np.ndarray:
+    return np.bincount(y.astype(np.int64) * num_classes + pred, minlength=num_classes ** 2).reshape(num_classes, -1)
 
-    cm = confusion_matrix(y_true, y_pred, labels=list(range(len(classes))))
-    report = classification_report(y_true, y_pred, target_names=classes, output_dict=True)
+def review_sweep(conf1: np.ndarray, margin: np.ndarray, pair: np.ndarray, correct: np.ndarray,
+                 conf_grid=CONF_GRID, margin_grid=MARGIN_GRID) -> List[Dict[str, float]]:
+    """needs_review rate vs. accuracy of the auto-accepted rest, for every threshold pair."""
+    rows = []
+    n = max(len(conf1), 1)
+    below_conf = conf1[None, :] < conf_grid[:, None]            # [T, N]
+    for m in margin_grid:
+        flagged = below_conf | (pair | (margin < m))[None, :]
+        accepted = ~flagged
+        n_acc = accepted.sum(axis=1)
+        n_ok = (accepted & correct[None, :]).sum(axis=1)
+        for t, na, nok in zip(conf_grid.tolist(), n_acc.tolist(), n_ok.tolist()):
+            rows.append({"confidence_threshold": t, "margin_threshold": float(m),
+                         "review_rate": 1.0 - na / n, "auto_accuracy": nok / na if na else 0.0})
+    return rows
 
-    save_json(cfg.metrics_dir / "classification_report.json", report)
+def evaluate_logits(logits: np.ndarray, y: np.ndarray, classes: Sequence[str],
+                    pcfg: PredictConfig) -> Dict[str, Any]:
+    probs = torch.softmax(torch.from_numpy(logits).float(), dim=1)
+    topk_vals, topk_idx, margin, pair = decision_signals(probs, list(classes), pcfg.topk)
+    review = needs_review_mask(topk_vals[:, 0], margin, pair, pcfg).numpy()
 
-    # Plot confusion matrix
+    pred = topk_idx[:, 0].numpy()
+    correct = pred == y
+    cm = confusion(y, pred, len(classes))
+    report = classification_report(y, pred, labels=list(range(len(classes))), target_names=list(classes),
+                                   output_dict=True, zero_division=0)
+    accepted = ~review
+    return {
+        "n": int(len(y)),
+        "accuracy": float(correct.mean()) if len(y) else 0.0,
+        "review_rate": float(review.mean()) if len(y) else 0.0,
+        "auto_accuracy": float(correct[accepted].mean()) if accepted.any() else 0.0,
+        "confusion_matrix": cm,
+        "report": report,
+        "sweep": review_sweep(topk_vals[:, 0].numpy(), margin.numpy(), pair.numpy(), correct),
+    }
+
+def plot_confusion(cm: np.ndarray, classes: Sequence[str], out_path: Path, title: str = "Confusion Matrix") -> None:
     fig = plt.figure()
     plt.imshow(cm, interpolation="nearest")
-    plt.title("Confusion Matrix")
+    plt.title(title)
     plt.xlabel("Predicted")
     plt.ylabel("True")
     plt.xticks(range(len(classes)), classes, rotation=45, ha="right")
@@ -66,12 +145,71 @@ def main():
         for j in range(cm.shape[1]):
             plt.text(j, i, str(cm[i, j]), ha="center", va="center")
     plt.tight_layout()
-    out_path = cfg.metrics_dir / "confusion_matrix.png"
     fig.savefig(out_path, dpi=200)
     plt.close(fig)
 
-    print("Saved:", out_path)
-    print("Saved:", cfg.metrics_dir / "classification_report.json")
+def main():
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Evaluate checkpoints from cached logits.")
+    parser.add_argument("--weights", type=Path, nargs="+", default=[cfg.output_dir / "model.pth"])
+    parser.add_argument("--splits", nargs="+", default=["test"], choices=SPLITS)
+    parser.add_argument("--labels", type=Path, default=cfg.output_dir / "labels.json")
+    parser.add_argument("--logits-dir", type=Path, default=cfg.metrics_dir / "logits")
+    parser.add_argument("--recompute", action="store_true", help="ignore cached logits")
+    args = parser.parse_args()
+
+    device = get_device(cfg.device)
+    ensure_dir(cfg.metrics_dir)
+
+    # Load labels
+    classes = load_json(args.labels)["classes"]
+    split_samples = dict(zip(SPLITS, load_splits(cfg, tuple(classes))))
+    pcfg = PredictConfig(image_size=cfg.image_size)
+    single = len(args.weights) == 1 and len(args.splits) == 1
+
+    summary = []
+    for weights in args.weights:
+        ckpt_hash = file_hash(weights)
+        model_name = resolve_model_name(weights, cfg.model_name)
+        model = None
+        for split in args.splits:
+            samples = split_samples[split]
+            key = f"{ckpt_hash}_{split}"
+            meta = logits_meta(ckpt_hash, split, samples, classes, model_name, cfg, device)
+            cached = None if args.recompute else load_cached_logits(args.logits_dir, key, meta)
+            if cached is None:
+                if model is None:
+                    model = load_finetuned(model_name, len(classes), weights, device=device)
+                    if cfg.channels_last:
+                        model = model.to(memory_format=torch.channels_last)
+                ds = make_dataset(cfg, samples, split, train=False)
+                loader = DataLoader(ds, shuffle=False, **loader_kwargs(cfg, device))
+                t0 = time.perf_counter()
+                logits, y = compute_logits(model, loader, device, cfg, len(ds), len(classes))
+                print(f"[{weights.name} / {split}] forward pass: {len(y)} samples in {time.perf_counter() - t0:.1f}s")
+                save_cached_logits(args.logits_dir, key, meta, logits, y)
+            else:
+                logits, y = cached
+
+            t0 = time.perf_counter()
+            res = evaluate_logits(logits, y, classes, pcfg)
+            dt_ms = (time.perf_counter() - t0) * 1000
+
+            out_dir = cfg.metrics_dir if single else cfg.metrics_dir / "eval" / f"{weights.stem}-{ckpt_hash[:8]}" / split
+            ensure_dir(out_dir)
+            save_json(out_dir / "classification_report.json", res["report"])
+            save_json(out_dir / "review_sweep.json", {"current": {"confidence_threshold": pcfg.confidence_threshold,
+                                                                  "margin_threshold": pcfg.margin_threshold},
+                                                      "rows": res["sweep"]})
+            plot_confusion(res["confusion_matrix"], classes, out_dir / "confusion_matrix.png",
+                           title=f"Confusion Matrix ({weights.name}, {split})")
+            print(f"[{weights.name} / {split}] acc={res['accuracy']:.4f} review_rate={res['review_rate']:.3f} "
+                  f"auto_acc={res['auto_accuracy']:.4f} (metrics in {dt_ms:.0f} ms) -> {out_dir}")
+            summary.append({"weights": str(weights), "checkpoint_hash": ckpt_hash, "split": split,
+                            **{k: res[k] for k in ("n", "accuracy", "review_rate", "auto_accuracy")}})
+
+    save_json(cfg.metrics_dir / "eval_summary.json", {"runs": summary})
+    print("Saved:", cfg.metrics_dir / "eval_summary.json")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import argparse
+import inspect
+import json
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from .augment import IMAGENET_MEAN, IMAGENET_STD
+from .config import Config
+from .model import load_finetuned, resolve_model_name
+from .utils import load_json, measure_latency
+
+def artifact_meta(model_name: str, image_size: int, classes, **extra) -> dict:
+    # everything a runtime needs to preprocess inputs and name outputs
+    meta = {
+        "model_name": model_name,
+        "image_size": image_size,
+        "mean": list(IMAGENET_MEAN),
+        "std": list(IMAGENET_STD),
+        "classes": list(classes),
+    }
+    meta.update(extra)
+    return meta
+
+def export_torchscript(model: nn.Module, out_path: Path, meta: dict, image_size: int) -> Path:
+    example = torch.randn(1, 3, image_size, image_size)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, example)
+    scripted = torch.jit.freeze(scripted.eval())
+    torch.jit.save(scripted, str(out_path), _extra_files={"meta.json": json.dumps(meta)})
+    return out_path
+
+def export_onnx(model: nn.Module, out_path: Path, meta: dict, image_size: int, opset: int = 17) -> Path:
+    import onnx  # optional dependency, only needed for this format
+
+    example = torch.randn(1, 3, image_size, image_size)
+    # stick to the TorchScript-based exporter where newer torch defaults to dynamo
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(model, (example,), str(out_path), input_names=["input"], output_names=["logits"],
+                      dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}}, opset_version=opset,
+                      **kwargs)
+    proto = onnx.load(str(out_path))
+    entry = proto.metadata_props.add()
+    entry.key, entry.value = "meta.json", json.dumps(meta)
+    onnx.save(proto, str(out_path))
+    return out_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model.pth to TorchScript (and optionally ONNX).")
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--onnx", action="store_true", help="also write <weights>.onnx (needs `onnx`)")
+    parser.add_argument("--bench", action="store_true", help="compare backend latency after export")
+    args = parser.parse_args()
+
+    cfg = Config()
+    classes = load_json(cfg.output_dir / "labels.json")["classes"]
+    model_name = resolve_model_name(args.weights, cfg.model_name)
+    model = load_finetuned(model_name, len(classes), args.weights, device="cpu")
+    meta = artifact_meta(model_name, cfg.image_size, classes, format="torchscript")
+
+    # written next to the checkpoint so load_model(backend=...) finds them
+    ts_path = export_torchscript(model, args.weights.with_suffix(".ts"), meta, cfg.image_size)
+    print("Saved:", ts_path)
+    if args.onnx:
+        onnx_path = export_onnx(model, args.weights.with_suffix(".onnx"), dict(meta, format="onnx"), cfg.image_size)
+        print("Saved:", onnx_path)
+
+    if args.bench:
+        from inference.api import load_model
+        backends = ["eager", "torchscript"] + (["onnx"] if args.onnx else [])
+        for name in backends:
+            m, _, _ = load_model(args.weights, cfg.output_dir / "labels.json", device="cpu", backend=name)
+            for bs in (1, 8):
+                lat = measure_latency(m, cfg.image_size, batch_size=bs)
+                print(f"{name:12s} bs={bs}: mean {lat['mean_ms']:.1f} ms  p90 {lat['p90_ms']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from .config import Config
+from .dataset import Sample
+
+# Persisted sample index (one .npz) so train/eval/quantize skip the directory walk:
+#   paths    utf-8 blob + offsets (relative to data_dir)
+#   labels / sizes / mtimes   one entry per file
+#   dir_mtimes / dir_starts   a class folder is rescanned only when its mtime changed
+#   split_{train,val,test}    index arrays, identical for every consumer
+# A folder's mtime changes on add/remove/rename, not on in-place rewrites: use --full then.
+#   python -m src.ml.index [--full]
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+SPLITS = ("train", "val", "test")
+
+def _pack(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def _scan_dir(data_dir: Path, cls: str) -> Dict[str, np.ndarray]:
+    names, sizes, mtimes = [], [], []
+    with os.scandir(data_dir / cls) as it:
+        for entry in it:
+            if os.path.splitext(entry.name)[1].lower() in IMAGE_SUFFIXES and entry.is_file():
+                st = entry.stat()
+                names.append(entry.name)
+                sizes.append(st.st_size)
+                mtimes.append(st.st_mtime_ns)
+    order = np.argsort(names, kind="stable")  # deterministic order, independent of the filesystem
+    return {"paths": [f"{cls}/{names[i]}" for i in order],
+            "sizes": np.asarray(sizes, dtype=np.int64)[order],
+            "mtimes": np.asarray(mtimes, dtype=np.int64)[order]}
+
+def _split_key(seed: int, ratios: Tuple[float, float, float], blob: np.ndarray, labels: np.ndarray) -> str:
+    h = hashlib.sha1(f"{seed}:{ratios}".encode("utf-8"))
+    h.update(blob.tobytes())
+    h.update(labels.tobytes())
+    return h.hexdigest()
+
+def compute_splits(labels: np.ndarray, seed: int, train_ratio: float, val_ratio: float,
+                   test_ratio: float) -> Dict[str, np.ndarray]:
+    # same stratified two-step split as train.split_samples, on index arrays
+    assert abs(train_ratio + val_ratio + test_ratio - 1.0) < 1e-6
+    idx = np.arange(len(labels))
+    train, temp = train_test_split(idx, test_size=(1.0 - train_ratio), random_state=seed, stratify=labels)
+    val_size = val_ratio / (val_ratio + test_ratio)
+    val, test = train_test_split(temp, test_size=(1.0 - val_size), random_state=seed, stratify=labels[temp])
+    return {"train": np.sort(train), "val": np.sort(val), "test": np.sort(test)}
+
+def load_index(index_path: Path) -> Dict[str, np.ndarray] | None:
+    if not index_path.exists():
+        return None
+    with np.load(index_path, allow_pickle=False) as z:
+        return {k: z[k] for k in z.files}
+
+def save_index(index: Dict[str, np.ndarray], index_path: Path) -> None:
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")  # concurrent writers never share a tmp
+    with tmp.open("wb") as f:
+        np.savez(f, **index)
+    os.replace(tmp, index_path)
+
+def update_index(data_dir: Path, classes: Sequence[str], index_path: Path, seed: int,
+                 ratios: Tuple[float, float, float], full: bool = False) -> Dict[str, np.ndarray]:
+    """Load the index, rescan only class folders whose mtime changed, recompute splits if needed."""
+    old = None if full else load_index(index_path)
+    if old is not None and (str(old["data_dir"]) != str(data_dir) or old["classes"].tolist() != list(classes)):
+        old = None
+
+    old_dirs: Dict[str, Tuple[int, int, int]] = {}
+    if old is not None:
+        starts = old["dir_starts"].tolist()
+        for i, name in enumerate(old["classes"].tolist()):
+            old_dirs[name] = (int(old["dir_mtimes"][i]), starts[i], starts[i + 1])
+
+    # per class folder: path bytes + their lengths, either spliced from the old index or rescanned
+    blobs, lengths, labels, sizes, mtimes, dir_mtimes, dir_starts = [], [], [], [], [], [], [0]
+    rescanned = []
+    for label, cls in enumerate(classes):
+        cls_dir = data_dir / cls
+        if not cls_dir.exists():
+            raise FileNotFoundError(f"Missing class folder: {cls_dir}")
+        dir_mtime = cls_dir.stat().st_mtime_ns
+        prev = old_dirs.get(cls)
+        if prev is not None and prev[0] == dir_mtime:
+            a, b = prev[1], prev[2]
+            off = old["path_offsets"]
+            blobs.append(old["paths"][off[a]:off[b]])
+            lengths.append(np.diff(off[a:b + 1]))
+            sizes.append(old["sizes"][a:b])
+            mtimes.append(old["mtimes"][a:b])
+        else:
+            scanned = _scan_dir(data_dir, cls)
+            blob, off = _pack(scanned["paths"])
+            blobs.append(blob)
+            lengths.append(np.diff(off))
+            sizes.append(scanned["sizes"])
+            mtimes.append(scanned["mtimes"])
+            rescanned.append(cls)
+        labels.append(np.full(len(lengths[-1]), label, dtype=np.int16))
+        dir_mtimes.append(dir_mtime)
+        dir_starts.append(dir_starts[-1] + len(lengths[-1]))
+
+    if dir_starts[-1] == 0:
+        raise RuntimeError("No images found. Check dataset path.")
+
+    blob = np.concatenate(blobs)
+    offsets = np.zeros(dir_starts[-1] + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(lengths), out=offsets[1:])
+    index = {
+        "data_dir": np.array(str(data_dir)),
+        "classes": np.array(list(classes)),
+        "paths": blob,
+        "path_offsets": offsets,
+        "labels": np.concatenate(labels),
+        "sizes": np.concatenate(sizes),
+        "mtimes": np.concatenate(mtimes),
+        "dir_mtimes": np.asarray(dir_mtimes, dtype=np.int64),
+        "dir_starts": np.asarray(dir_starts, dtype=np.int64),
+    }
+
+    key = _split_key(seed, ratios, blob, index["labels"])
+    if old is not None and not rescanned and str(old.get("split_key", "")) == key:
+        return old  # nothing changed on disk
+    if old is not None and str(old.get("split_key", "")) == key:
+        splits = {s: old[f"split_{s}"] for s in SPLITS}
+    else:
+        splits = compute_splits(index["labels"], seed, *ratios)
+    index["split_key"] = np.array(key)
+    for s in SPLITS:
+        index[f"split_{s}"] = splits[s]
+    save_index(index, index_path)
+    return index
+
+def load_split_samples(cfg: Config, classes: Sequence[str] | None = None) -> Tuple[List[Sample], ...]:
+    """(train, val, test) Sample lists from the persisted index (refreshed incrementally)."""
+    classes = tuple(classes or cfg.classes)
+    index = update_index(cfg.data_dir, classes, cfg.sample_index_path, cfg.seed,
+                         (cfg.train_ratio, cfg.val_ratio, cfg.test_ratio))
+    raw = index["paths"].tobytes()
+    offsets = index["path_offsets"].tolist()
+    labels = index["labels"].tolist()
+    out = []
+    for s in SPLITS:
+        out.append([Sample(path=cfg.data_dir / raw[offsets[i]:offsets[i + 1]].decode("utf-8"), label_idx=labels[i])
+                    for i in index[f"split_{s}"].tolist()])
+    return tuple(out)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / refresh the persisted sample index.")
+    parser.add_argument("--full", action="store_true", help="rescan every class folder")
+    args = parser.parse_args()
+
+    cfg = Config()
+    t0 = time.perf_counter()
+    index = update_index(cfg.data_dir, cfg.classes, cfg.sample_index_path, cfg.seed,
+                         (cfg.train_ratio, cfg.val_ratio, cfg.test_ratio), full=args.full)
+    dt = time.perf_counter() - t0
+    counts = ", ".join(f"{s}={len(index[f'split_{s}'])}" for s in SPLITS)
+    print(f"{len(index['labels'])} samples ({counts}) in {dt:.2f}s -> {cfg.sample_index_path}")
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,94 @@
+import json
+import os
+import zipfile
+from pathlib import Path
+
 import torch
 import torch.nn as nn
 from torchvision import models
 
-def create_model(model_name: str, num_classes: int) -> nn.Module:
-    if model_name == "resnet18":
-        m = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
-        in_features = m.fc.in_features
-        m.fc = nn.Linear(in_features, num_classes)
-        return m
-
-    # fallback
-    m = models.resnet18(weights=models.ResNet18_Weights.DEFAULT)
-    in_features = m.fc.in_features
-    m.fc = nn.Linear(in_features, num_classes)
+# name -> (builder, ImageNet weights enum); all take weights=None for a bare architecture
+BACKBONES = {
+    "resnet18": (models.resnet18, models.ResNet18_Weights),
+    "mobilenet_v3_small": (models.mobilenet_v3_small, models.MobileNet_V3_Small_Weights),
+    "shufflenet_v2_x1_0": (models.shufflenet_v2_x1_0, models.ShuffleNet_V2_X1_0_Weights),
+    "efficientnet_b0": (models.efficientnet_b0, models.EfficientNet_B0_Weights),
+}
+
+def _replace_head(m: nn.Module, num_classes: int) -> None:
+    if isinstance(getattr(m, "fc", None), nn.Linear):          # resnet, shufflenet
+        m.fc = nn.Linear(m.fc.in_features, num_classes)
+    elif isinstance(getattr(m, "classifier", None), nn.Sequential):  # mobilenet, efficientnet
+        last = m.classifier[-1]
+        m.classifier[-1] = nn.Linear(last.in_features, num_classes)
+    else:
+        raise TypeError(f"Don't know where the classifier head of {type(m).__name__} is")
+
+def create_model(model_name: str, num_classes: int, pretrained: bool = True) -> nn.Module:
+    # pretrained=False builds the bare architecture (no ImageNet download),
+    # use it whenever a fine-tuned state dict is loaded right after
+    if model_name not in BACKBONES:
+        raise ValueError(f"Unknown model_name {model_name!r}, expected one of {sorted(BACKBONES)}")
+    builder, weights_enum = BACKBONES[model_name]
+    m = builder(weights=weights_enum.DEFAULT if pretrained else None)
+    _replace_head(m, num_classes)
     return m
 
+# --- Architecture sidecar: models/model.pth -> models/model.json ---
+
+def arch_meta_path(weights_path: str | Path) -> Path:
+    return Path(weights_path).with_suffix(".json")
+
+def save_arch_meta(weights_path: str | Path, model_name: str, num_classes: int, image_size: int, **extra) -> Path:
+    path = arch_meta_path(weights_path)
+    meta = {"model_name": model_name, "num_classes": num_classes, "image_size": image_size, **extra}
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+def read_arch_meta(weights_path: str | Path) -> dict:
+    path = arch_meta_path(weights_path)
+    if not path.exists():
+        return {}  # older weights: caller's model_name (resnet18) applies
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def resolve_model_name(weights_path: str | Path, default: str) -> str:
+    return read_arch_meta(weights_path).get("model_name", default)
+
+def load_state_dict_file(path: str | Path, map_location="cpu") -> dict:
+    # mmap + weights_only: tensors are paged in lazily and nothing is unpickled
+    try:
+        return torch.load(str(path), map_location=map_location, mmap=True, weights_only=True)
+    except RuntimeError:
+        # legacy (non-zipfile) checkpoints can't be memory-mapped
+        return torch.load(str(path), map_location=map_location, weights_only=True)
+
+def load_finetuned(model_name: str, num_classes: int, weights_path: str | Path, device="cpu") -> nn.Module:
+    # the sidecar written at training time wins over the caller's default architecture
+    model_name = resolve_model_name(weights_path, model_name)
+    # build on the meta device (no random init), then adopt the loaded tensors
+    with torch.device("meta"):
+        m = create_model(model_name, num_classes, pretrained=False)
+    state = load_state_dict_file(weights_path, map_location=device)
+    m.load_state_dict(state, assign=True)
+    return m.to(device).eval()
+
+def is_torchscript_archive(path: str | Path) -> bool:
+    # both torch.save and torch.jit.save write zip archives; only TorchScript has code/
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as zf:
+        return any("/code/" in name for name in zf.namelist())
+
+def read_archive_meta(path: str | Path) -> dict:
+    # `meta.json` stored via torch.jit.save(..., _extra_files=...) by quantize/export
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            if name.endswith("/extra/meta.json"):
+                return json.loads(zf.read(name).decode("utf-8"))
+    return {}
+
 @torch.no_grad()
 def predict_logits(model: nn.Module, x: torch.Tensor) -> torch.Tensor:
     model.eval()
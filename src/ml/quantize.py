@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision.models import quantization as qmodels
+
+from .config import Config
+from .export import artifact_meta
+from .model import load_finetuned, load_state_dict_file, resolve_model_name
+from .train import load_splits, make_dataset, make_batch_transform, loader_kwargs
+from .utils import ensure_dir, load_json, save_json, measure_latency
+
+def default_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    for e in ("x86", "fbgemm", "qnnpack"):
+        if e in engines:
+            return e
+    raise RuntimeError("No quantized engine available in this torch build")
+
+def build_quantizable(model_name: str, num_classes: int, weights_path: str | Path) -> nn.Module:
+    if model_name != "resnet18":
+        raise ValueError(f"Static quantization is only wired for resnet18, got {model_name!r}")
+    # same parameter names as torchvision ResNet, plus quant/dequant stubs
+    m = qmodels.resnet18(weights=None, quantize=False)
+    m.fc = nn.Linear(m.fc.in_features, num_classes)
+    m.load_state_dict(load_state_dict_file(weights_path))
+    return m.eval()
+
+@torch.no_grad()
+def quantize_static(model: nn.Module, calib_loader, batch_tf, engine: str, num_batches: int) -> nn.Module:
+    torch.backends.quantized.engine = engine
+    model.fuse_model(is_qat=False)  # conv+bn(+relu)
+    model.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(model, inplace=True)
+
+    # calibration: observers record activation ranges on real data
+    for i, (x, _) in enumerate(calib_loader):
+        if i >= num_batches:
+            break
+        if batch_tf is not None:
+            x = batch_tf(x)
+        model(x)
+
+    torch.ao.quantization.convert(model, inplace=True)
+    return model
+
+@torch.no_grad()
+def eval_accuracy(model, loader, batch_tf) -> float:
+    correct, n = 0, 0
+    for x, y in loader:
+        if batch_tf is not None:
+            x = batch_tf(x)
+        correct += int((torch.argmax(model(x), dim=1) == y).sum())
+        n += y.numel()
+    return correct / max(n, 1)
+
+def save_quantized(qmodel: nn.Module, out_path: Path, meta: dict, image_size: int) -> None:
+    ensure_dir(out_path.parent)
+    example = torch.randn(1, 3, image_size, image_size)
+    with torch.no_grad():
+        scripted = torch.jit.trace(qmodel, example)
+    torch.jit.save(scripted, str(out_path), _extra_files={"meta.json": json.dumps(meta)})
+
+def main():
+    parser = argparse.ArgumentParser(description="Static INT8 post-training quantization (CPU serving).")
+    parser.add_argument("--weights", type=Path, default=Path("models/model.pth"))
+    parser.add_argument("--out", type=Path, default=Path("models/model_int8.pt"))
+    parser.add_argument("--calib-batches", type=int, default=10)
+    parser.add_argument("--engine", default=None, help="x86 / fbgemm / qnnpack (default: best available)")
+    args = parser.parse_args()
+
+    cfg = Config()
+    engine = args.engine or default_engine()
+    classes = load_json(cfg.output_dir / "labels.json")["classes"]
+
+    _, val_s, test_s = load_splits(cfg, tuple(classes))
+    cpu = torch.device("cpu")
+    val_loader = DataLoader(make_dataset(cfg, val_s, "val", train=False), shuffle=False, **loader_kwargs(cfg, cpu))
+    test_loader = DataLoader(make_dataset(cfg, test_s, "test", train=False), shuffle=False, **loader_kwargs(cfg, cpu))
+    batch_tf = make_batch_transform(cfg, train=False)
+
+    model_name = resolve_model_name(args.weights, cfg.model_name)
+    fp32 = load_finetuned(model_name, len(classes), args.weights, device="cpu")
+    qmodel = quantize_static(build_quantizable(model_name, len(classes), args.weights),
+                             val_loader, batch_tf, engine, args.calib_batches)
+
+    meta = artifact_meta(model_name, cfg.image_size, classes,
+                         format="torchscript", quantized=True, engine=engine)
+    save_quantized(qmodel, args.out, meta, cfg.image_size)
+    print("Saved:", args.out)
+
+    print("Evaluating fp32 vs int8 on the test split...")
+    report = {
+        "engine": engine,
+        "calib_batches": args.calib_batches,
+        "num_threads": torch.get_num_threads(),
+        "fp32": {
+            "path": str(args.weights),
+            "size_mb": args.weights.stat().st_size / 1e6,
+            "test_acc": eval_accuracy(fp32, test_loader, batch_tf),
+            "latency": measure_latency(fp32, cfg.image_size),
+        },
+        "int8": {
+            "path": str(args.out),
+            "size_mb": args.out.stat().st_size / 1e6,
+            "test_acc": eval_accuracy(qmodel, test_loader, batch_tf),
+            "latency": measure_latency(qmodel, cfg.image_size),
+        },
+    }
+    report["speedup"] = report["fp32"]["latency"]["mean_ms"] / max(report["int8"]["latency"]["mean_ms"], 1e-9)
+    report["acc_drop"] = report["fp32"]["test_acc"] - report["int8"]["test_acc"]
+
+    out_json = cfg.metrics_dir / "quantization.json"
+    save_json(out_json, report)
+    print(f"fp32 acc={report['fp32']['test_acc']:.3f} {report['fp32']['latency']['mean_ms']:.1f} ms | "
+          f"int8 acc={report['int8']['test_acc']:.3f} {report['int8']['latency']['mean_ms']:.1f} ms | "
+          f"speedup x{report['speedup']:.2f}")
+    print("Saved:", out_json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import tarfile
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple
+
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+from tqdm import tqdm
+
+from .config import Config
+from .dataset import Sample
+
+# Sequential-read dataset format for object-storage mounts: samples packed into large
+# tar shards (<key>.<ext> original bytes + <key>.cls label), read front to back.
+#   python -m src.ml.shards              # packs train/val/test into Config.shard_dir
+# <split>.json lists the shards and their sample counts.
+
+def _fingerprint(samples: Sequence[Sample]) -> str:
+    # size + mtime like the image cache: an image rewritten in place invalidates the shards
+    h = hashlib.sha1()
+    for s in samples:
+        st = os.stat(s.path)
+        h.update(f"{s.path}\t{s.label_idx}\t{st.st_size}\t{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+def write_shards(samples: Sequence[Sample], out_dir: Path, split: str, shard_size: int = 1000,
+                 seed: int = 42) -> Path:
+    """Pack `samples` into <split>-NNNNN.tar files; reuse them if no sample was added, removed or modified."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / f"{split}.json"
+    fingerprint = _fingerprint(samples)
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest.get("fingerprint") == fingerprint and all((out_dir / s["name"]).exists()
+                                                               for s in manifest["shards"]):
+            return manifest_path
+
+    # mix classes across shards so a shuffle buffer sees every class early
+    order = list(range(len(samples)))
+    random.Random(seed).shuffle(order)
+
+    shards = []
+    for start in tqdm(range(0, len(order), shard_size), desc=f"shards {split}", leave=False):
+        name = f"{split}-{len(shards):05d}.tar"
+        tmp = out_dir / (name + ".tmp")
+        chunk = order[start:start + shard_size]
+        with tarfile.open(tmp, "w") as tar:
+            for i in chunk:
+                s = samples[i]
+                key = f"{i:09d}"
+                _add_bytes(tar, f"{key}{s.path.suffix.lower()}", s.path.read_bytes())
+                _add_bytes(tar, f"{key}.cls", str(s.label_idx).encode("ascii"))
+        os.replace(tmp, out_dir / name)
+        shards.append({"name": name, "count": len(chunk)})
+
+    manifest = {"fingerprint": fingerprint, "split": split, "total": len(samples), "shards": shards}
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest_path
+
+def iter_shard(path: Path) -> Iterator[Tuple[bytes, int]]:
+    """(image bytes, label) pairs from one shard, as a single sequential read."""
+    image, label, key = None, None, None
+    with tarfile.open(path, "r|") as tar:  # stream mode: no seeking back for the member index
+        for member in tar:
+            if not member.isfile():
+                continue
+            stem, ext = os.path.splitext(member.name)
+            if stem != key:
+                image, label, key = None, None, stem
+            data = tar.extractfile(member).read()
+            if ext == ".cls":
+                label = int(data)
+            else:
+                image = data
+            if image is not None and label is not None:
+                yield image, label
+                image, label, key = None, None, None
+
+class ShardedTrashDataset(IterableDataset):
+    """Streams <split> shards; shard order shuffled per epoch, then a sample shuffle buffer.
+
+    Shards are divided over (rank, DataLoader worker). With several ranks every rank yields
+    exactly len(self) samples (wrapping around its shards if short) so DDP steps stay in lockstep.
+    """
+
+    def __init__(self, manifest_path: Path, transform=None, shuffle: bool = False,
+                 shuffle_buffer: int = 1000, seed: int = 42):
+        manifest = json.loads(Path(manifest_path).read_text(encoding="utf-8"))
+        self.shard_paths = [Path(manifest_path).parent / s["name"] for s in manifest["shards"]]
+        self.total = manifest["total"]
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.seed = seed
+        # shared with DataLoader workers (persistent ones keep their dataset copy across epochs),
+        # so the order depends only on (seed, epoch) and --resume replays the same stream
+        self._epoch = multiprocessing.Value("q", 0, lock=False)
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch.value
+
+    def set_epoch(self, epoch: int) -> None:
+        # like DistributedSampler.set_epoch: call before iterating each epoch
+        self._epoch.value = epoch
+
+    @staticmethod
+    def _world() -> Tuple[int, int]:
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+
+    def __len__(self) -> int:
+        _, world = self._world()
+        return self.total if world == 1 else self.total // world
+
+    def _decode(self, data: bytes):
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        return self.transform(img) if self.transform else img
+
+    def _assigned(self, rng: random.Random) -> Tuple[List[Path], int, int]:
+        rank, world = self._world()
+        info = get_worker_info()
+        wid, nw = (info.id, info.num_workers) if info is not None else (0, 1)
+        gid, total = rank * nw + wid, world * nw
+
+        shards = list(self.shard_paths)
+        if self.shuffle:
+            rng.shuffle(shards)  # same order on every rank/worker: rng is seeded by epoch only
+        if len(shards) >= total:
+            return shards[gid::total], 0, 1
+        # fewer shards than readers: everyone reads all shards and keeps every total-th sample
+        return shards, gid, total
+
+    def _stream(self, shards: List[Path], offset: int, stride: int) -> Iterator[Tuple[bytes, int]]:
+        i = 0
+        for path in shards:
+            for item in iter_shard(path):
+                if i % stride == offset:
+                    yield item
+                i += 1
+
+    def __iter__(self):
+        rng = random.Random(f"{self.seed}:{self.epoch}")
+        shards, offset, stride = self._assigned(rng)
+
+        _, world = self._world()
+        quota = None
+        if world > 1:
+            info = get_worker_info()
+            wid, nw = (info.id, info.num_workers) if info is not None else (0, 1)
+            per_rank = len(self)
+            quota = per_rank // nw + (1 if wid < per_rank % nw else 0)
+
+        def source():
+            n = 0
+            while True:
+                produced = False
+                for item in self._stream(shards, offset, stride):
+                    if quota is not None and n >= quota:
+                        return
+                    yield item
+                    produced = True
+                    n += 1
+                if quota is None or n >= quota or not produced:
+                    return  # single rank: one pass; several ranks: wrap around until quota
+
+        if self.shuffle_buffer <= 0:
+            for data, label in source():
+                yield self._decode(data), label
+            return
+
+        buf_rng = random.Random(rng.random())
+        buffer: List[Tuple[bytes, int]] = []
+        for item in source():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            j = buf_rng.randrange(len(buffer))
+            out, buffer[j] = buffer[j], item
+            yield self._decode(out[0]), out[1]
+        buf_rng.shuffle(buffer)
+        for data, label in buffer:
+            yield self._decode(data), label
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the train/val/test splits into tar shards.")
+    parser.add_argument("--shard-size", type=int, default=None, help="samples per shard (default: Config.shard_size)")
+    args = parser.parse_args()
+
+    from .train import load_splits  # train imports this module for make_dataset
+    cfg = Config()
+    for split, samples in zip(("train", "val", "test"), load_splits(cfg)):
+        path = write_shards(samples, cfg.shard_dir, split, args.shard_size or cfg.shard_size, cfg.seed)
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        print(f"{split}: {manifest['total']} samples in {len(manifest['shards'])} shards -> {cfg.shard_dir}")
+
+if __name__ == "__main__":
+    main()
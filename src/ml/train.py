@@ -1,19 +1,32 @@
 from __future__ import annotations
 
+import argparse
 import csv
+import time
+from dataclasses import replace
 from pathlib import Path
 from typing import Dict, List, Tuple
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
+import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
 
+from .checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint, capture_rng_state, restore_rng_state
 from .config import Config
-from .dataset import Sample, TrashDataset, build_transforms
-from .model import create_model
-from .utils import set_seed, ensure_dir, save_json, get_device
+from .augment import BatchAugment
+from .dataset import (Sample, TrashDataset, CachedTrashDataset, build_transforms,
+                      build_cached_transforms, build_image_cache, build_uint8_transform)
+from .index import load_split_samples
+from .distributed import (init_distributed, cleanup, is_main_process, main_process_first,
+                          reduce_epoch_totals, broadcast_flag, gather_objects)
+from .model import create_model, load_finetuned, save_arch_meta
+from .shards import ShardedTrashDataset, write_shards
+from .utils import (set_seed, ensure_dir, save_json, get_device, autocast, resolve_amp_dtype,
+                    make_grad_scaler, maybe_compile)
 
 def gather_samples(data_dir: Path, classes: Tuple[str, ...]) -> List[Sample]:
     samples: List[Sample] = []
@@ -37,116 +50,361 @@ def split_samples(samples: List[Sample], seed: int, train_ratio: float, val_rati
     val, test = train_test_split(temp, test_size=(1.0-val_size), random_state=seed, stratify=y_temp)
     return train, val, test
 
-def accuracy(logits: torch.Tensor, y: torch.Tensor) -> float:
-    preds = torch.argmax(logits, dim=1)
-    return (preds == y).float().mean().item()
+def load_splits(cfg: Config, classes: Tuple[str, ...] | None = None):
+    """(train, val, test) samples: from the persisted index, or a fresh walk + split."""
+    classes = tuple(classes or cfg.classes)
+    if cfg.use_sample_index:
+        return load_split_samples(cfg, classes)
+    samples = gather_samples(cfg.data_dir, classes)
+    return split_samples(samples, cfg.seed, cfg.train_ratio, cfg.val_ratio, cfg.test_ratio)
 
-def train_one_epoch(model, loader, criterion, optimizer, device) -> Tuple[float, float]:
+def make_dataset(cfg: Config, samples: List[Sample], split: str, train: bool):
+    if cfg.data_format == "shards":
+        manifest = write_shards(samples, cfg.shard_dir, split, cfg.shard_size, cfg.seed)
+        if cfg.augment_on_device:
+            tf = build_uint8_transform(cfg.image_size)
+        else:
+            train_tf, eval_tf = build_transforms(cfg.image_size)
+            tf = train_tf if train else eval_tf
+        return ShardedTrashDataset(manifest, transform=tf, shuffle=train,
+                                   shuffle_buffer=cfg.shuffle_buffer, seed=cfg.seed)
+    if cfg.data_format != "files":
+        raise ValueError(f"Unknown data_format: {cfg.data_format}")
+    if cfg.use_image_cache:
+        index_path = build_image_cache(samples, cfg.cache_dir, split, cfg.image_size)
+        if cfg.augment_on_device:
+            return CachedTrashDataset(index_path)  # raw uint8 tensors
+        train_tf, eval_tf = build_cached_transforms()
+        return CachedTrashDataset(index_path, transform=train_tf if train else eval_tf)
+    if cfg.augment_on_device:
+        return TrashDataset(samples, transform=build_uint8_transform(cfg.image_size))
+    train_tf, eval_tf = build_transforms(cfg.image_size)
+    return TrashDataset(samples, transform=train_tf if train else eval_tf)
+
+def make_batch_transform(cfg: Config, train: bool):
+    # None -> the dataset already produced normalized float tensors
+    return BatchAugment(train=train) if cfg.augment_on_device else None
+
+def loader_kwargs(cfg: Config, device: torch.device) -> dict:
+    kw = dict(batch_size=cfg.batch_size, num_workers=cfg.num_workers,
+              pin_memory=cfg.pin_memory and device.type == "cuda")
+    if cfg.num_workers > 0:
+        kw["persistent_workers"] = cfg.persistent_workers
+        kw["prefetch_factor"] = cfg.prefetch_factor
+    return kw
+
+def _show_running(pbar, total_loss: torch.Tensor, correct: torch.Tensor, n: int) -> None:
+    # the only host sync inside the step loop, every `log_every` steps
+    pbar.set_postfix(loss=f"{total_loss.item() / n:.4f}", acc=f"{correct.item() / n:.3f}")
+
+class DistillationLoss(nn.Module):
+    """alpha * T^2 * KL(student_T || teacher_T) + (1 - alpha) * CE(student, labels)."""
+
+    def __init__(self, alpha: float = 0.7, temperature: float = 4.0):
+        super().__init__()
+        self.alpha = alpha
+        self.temperature = temperature
+
+    def forward(self, logits: torch.Tensor, y: torch.Tensor, teacher_logits: torch.Tensor) -> torch.Tensor:
+        t = self.temperature
+        soft = F.kl_div(F.log_softmax(logits.float() / t, dim=1), F.log_softmax(teacher_logits.float() / t, dim=1),
+                        reduction="batchmean", log_target=True) * (t * t)
+        return self.alpha * soft + (1.0 - self.alpha) * F.cross_entropy(logits, y)
+
+def train_one_epoch(model, loader, criterion, optimizer, device, batch_transform=None,
+                    amp_dtype=None, scaler=None, channels_last: bool = False,
+                    non_blocking: bool = False, log_every: int = 0, teacher=None) -> Tuple[float, float]:
     model.train()
-    total_loss = 0.0
-    total_acc = 0.0
+    # running sums stay on device; read back once at the end of the epoch
+    total_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
     n = 0
-    for x, y in tqdm(loader, desc="train", leave=False):
-        x, y = x.to(device), y.to(device)
+    pbar = tqdm(loader, desc="train", leave=False, disable=not is_main_process())
+    for step, (x, y) in enumerate(pbar, 1):
+        x, y = x.to(device, non_blocking=non_blocking), y.to(device, non_blocking=non_blocking)
+        if batch_transform is not None:
+            x = batch_transform(x)
+        if channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         optimizer.zero_grad(set_to_none=True)
-        logits = model(x)
-        loss = criterion(logits, y)
-        loss.backward()
-        optimizer.step()
-
-        bs = x.size(0)
-        total_loss += loss.item() * bs
-        total_acc += accuracy(logits, y) * bs
+        with autocast(device, amp_dtype):
+            logits = model(x)
+            if teacher is not None:
+                with torch.no_grad():
+                    teacher_logits = teacher(x)
+                loss = criterion(logits, y, teacher_logits)
+            else:
+                loss = criterion(logits, y)
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
+
+        bs = y.size(0)
+        total_loss += loss.detach().float() * bs
+        correct += (torch.argmax(logits.detach(), dim=1) == y).sum()
         n += bs
-    return total_loss / n, total_acc / n
+        if log_every and step % log_every == 0:
+            _show_running(pbar, total_loss, correct, n)
+    return reduce_epoch_totals(total_loss, correct, n)
 
 @torch.no_grad()
-def eval_one_epoch(model, loader, criterion, device) -> Tuple[float, float]:
+def eval_one_epoch(model, loader, criterion, device, batch_transform=None,
+                   amp_dtype=None, channels_last: bool = False,
+                   non_blocking: bool = False, log_every: int = 0) -> Tuple[float, float]:
     model.eval()
-    total_loss = 0.0
-    total_acc = 0.0
+    total_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
     n = 0
-    for x, y in tqdm(loader, desc="val", leave=False):
-        x, y = x.to(device), y.to(device)
-        logits = model(x)
-        loss = criterion(logits, y)
-
-        bs = x.size(0)
-        total_loss += loss.item() * bs
-        total_acc += accuracy(logits, y) * bs
+    pbar = tqdm(loader, desc="val", leave=False, disable=not is_main_process())
+    for step, (x, y) in enumerate(pbar, 1):
+        x, y = x.to(device, non_blocking=non_blocking), y.to(device, non_blocking=non_blocking)
+        if batch_transform is not None:
+            x = batch_transform(x)
+        if channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with autocast(device, amp_dtype):
+            logits = model(x)
+            loss = criterion(logits, y)
+
+        bs = y.size(0)
+        total_loss += loss.float() * bs
+        correct += (torch.argmax(logits, dim=1) == y).sum()
         n += bs
-    return total_loss / n, total_acc / n
+        if log_every and step % log_every == 0:
+            _show_running(pbar, total_loss, correct, n)
+    return reduce_epoch_totals(total_loss, correct, n)
+
+LOG_HEADER = ["epoch", "train_loss", "train_acc", "val_loss", "val_acc", "train_ips", "val_ips"]
+
+def open_train_log(log_path: Path, start_epoch: int):
+    # resuming keeps the rows of finished epochs; the file then stays open for the whole run
+    rows = []
+    if start_epoch > 1 and log_path.exists():
+        with log_path.open("r", newline="", encoding="utf-8") as f:
+            rows = [r for r in csv.reader(f)][1:]
+        rows = [r for r in rows if r and int(r[0]) < start_epoch]
+    f = log_path.open("w", newline="", encoding="utf-8")
+    writer = csv.writer(f)
+    writer.writerow(LOG_HEADER)
+    writer.writerows(rows)
+    f.flush()
+    return f, writer
 
-def main():
-    cfg = Config()
-    set_seed(cfg.seed)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the TrashNet classifier.")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="CKPT",
+                        help="continue from a checkpoint (default: newest in Config.checkpoint_dir)")
+    parser.add_argument("--model-name", default=None, help="backbone, overrides Config.model_name")
+    parser.add_argument("--distill-from", type=Path, default=None, help="teacher weights, e.g. models/model.pth")
+    parser.add_argument("--weights-name", default=None, help="output file in models/ (Config.weights_name)")
+    return parser.parse_args(argv)
 
-    ensure_dir(cfg.output_dir)
-    ensure_dir(cfg.metrics_dir)
+def apply_cli_overrides(cfg: Config, args) -> Config:
+    overrides = {k: v for k, v in (("model_name", args.model_name), ("distill_from", args.distill_from),
+                                   ("weights_name", args.weights_name)) if v is not None}
+    cfg = replace(cfg, **overrides)
+    best_path = cfg.output_dir / cfg.weights_name
+    if cfg.distill_from is not None and best_path.resolve() == Path(cfg.distill_from).resolve():
+        # never overwrite the teacher with the student
+        cfg = replace(cfg, weights_name=f"model_{cfg.model_name}.pth")
+    if cfg.weights_name != "model.pth":
+        # separate resume checkpoints per output model: models/checkpoints/<stem>/
+        cfg = replace(cfg, checkpoint_dir=cfg.checkpoint_dir / Path(cfg.weights_name).stem)
+    return cfg
+
+def main(argv=None):
+    args = parse_args(argv)
+    cfg = apply_cli_overrides(Config(), args)
+    dist_info = init_distributed(cfg.dist_backend)
+    main_rank = dist_info.is_main
+    # same split on every rank (split_samples takes cfg.seed); different augmentation streams per rank
+    set_seed(cfg.seed + dist_info.rank)
+
+    if main_rank:
+        ensure_dir(cfg.output_dir)
+        ensure_dir(cfg.metrics_dir)
 
     device = get_device(cfg.device)
-    print(f"Using device: {device}")
+    if dist_info.enabled and device.type == "cuda":
+        device = torch.device("cuda", dist_info.local_rank)
+        torch.cuda.set_device(device)
+    if main_rank:
+        print(f"Using device: {device}" + (f" x {dist_info.world_size} ranks" if dist_info.enabled else ""))
 
-    samples = gather_samples(cfg.data_dir, cfg.classes)
-    train_s, val_s, test_s = split_samples(samples, cfg.seed, cfg.train_ratio, cfg.val_ratio, cfg.test_ratio)
+    # rank 0 builds/refreshes the sample index and image cache, the other ranks then only read them
+    with main_process_first():
+        train_s, val_s, test_s = load_splits(cfg)
+        train_ds = make_dataset(cfg, train_s, "train", train=True)
+        val_ds = make_dataset(cfg, val_s, "val", train=False)
 
-    train_tf, eval_tf = build_transforms(cfg.image_size)
-    train_ds = TrashDataset(train_s, transform=train_tf)
-    val_ds = TrashDataset(val_s, transform=eval_tf)
+    train_sampler = val_sampler = None
+    streaming = isinstance(train_ds, IterableDataset)  # shards split themselves over ranks/workers
+    if dist_info.enabled and not streaming:
+        # each rank sees 1/world_size of the split; val pads up to a multiple of world_size
+        train_sampler = DistributedSampler(train_ds, shuffle=True, seed=cfg.seed)
+        val_sampler = DistributedSampler(val_ds, shuffle=False)
+    train_loader = DataLoader(train_ds, shuffle=train_sampler is None and not streaming, sampler=train_sampler,
+                              **loader_kwargs(cfg, device))
+    val_loader = DataLoader(val_ds, shuffle=False, sampler=val_sampler, **loader_kwargs(cfg, device))
 
-    train_loader = DataLoader(train_ds, batch_size=cfg.batch_size, shuffle=True, num_workers=cfg.num_workers)
-    val_loader = DataLoader(val_ds, batch_size=cfg.batch_size, shuffle=False, num_workers=cfg.num_workers)
+    train_batch_tf = make_batch_transform(cfg, train=True)
+    val_batch_tf = make_batch_transform(cfg, train=False)
 
     model = create_model(cfg.model_name, num_classes=len(cfg.classes)).to(device)
+    if cfg.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    amp_dtype = resolve_amp_dtype(cfg.amp_dtype, device.type)
+    scaler = make_grad_scaler(device, amp_dtype)
+
+    # DDP / compiled wrappers share parameters with `model`; state_dict is saved from `model`
+    step_model = model
+    if dist_info.enabled:
+        step_model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None)
+    example = torch.zeros(cfg.batch_size, 3, cfg.image_size, cfg.image_size, device=device)
+    if cfg.channels_last:
+        example = example.contiguous(memory_format=torch.channels_last)
+    step_model = maybe_compile(step_model, cfg.compile_mode, example)
 
     criterion = nn.CrossEntropyLoss()
+    train_criterion, teacher = criterion, None
+    if cfg.distill_from is not None:
+        # teacher architecture comes from its sidecar (resnet18 for older weights)
+        teacher = load_finetuned("resnet18", len(cfg.classes), cfg.distill_from, device=device)
+        teacher.requires_grad_(False)
+        if cfg.channels_last:
+            teacher = teacher.to(memory_format=torch.channels_last)
+        train_criterion = DistillationLoss(cfg.distill_alpha, cfg.distill_temperature)
+        if main_rank:
+            print(f"Distilling {cfg.model_name} from {cfg.distill_from} "
+                  f"(alpha={cfg.distill_alpha}, T={cfg.distill_temperature})")
     optimizer = torch.optim.Adam(model.parameters(), lr=cfg.lr, weight_decay=cfg.weight_decay)
 
     best_val_acc = -1.0
-    best_path = cfg.output_dir / "model.pth"
+    best_path = cfg.output_dir / cfg.weights_name
     labels_path = cfg.output_dir / "labels.json"
+    patience_left = cfg.patience
+    start_epoch = 1
 
-    # save labels order once
-    save_json(labels_path, {"classes": list(cfg.classes)})
+    rng_state = None
+    if args.resume:
+        ckpt_path = latest_checkpoint(cfg.checkpoint_dir) if args.resume == "latest" else Path(args.resume)
+        if ckpt_path is None or not ckpt_path.exists():
+            raise FileNotFoundError(f"No checkpoint to resume from ({args.resume}, dir {cfg.checkpoint_dir})")
+        ckpt = load_checkpoint(ckpt_path)
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        if scaler is not None and ckpt["scaler"] is not None:
+            scaler.load_state_dict(ckpt["scaler"])
+        start_epoch = ckpt["epoch"] + 1
+        best_val_acc = ckpt["best_val_acc"]
+        patience_left = ckpt["patience_left"]
+        rngs = ckpt["rng"]
+        rng_state = rngs[dist_info.rank] if dist_info.rank < len(rngs) else None
+        if main_rank:
+            print(f"Resuming from {ckpt_path} at epoch {start_epoch} (best val_acc={best_val_acc:.3f})")
+            if cfg.num_workers > 0 and cfg.persistent_workers:
+                print("  note: persistent DataLoader workers are re-seeded on resume; "
+                      "augmentations match exactly only with num_workers=0 or persistent_workers=False")
 
     log_path = cfg.metrics_dir / "train_log.csv"
-    with log_path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["epoch", "train_loss", "train_acc", "val_loss", "val_acc"])
+    log_file = log_writer = ckpt_writer = None
+    if main_rank:
+        # save labels order once
+        save_json(labels_path, {"classes": list(cfg.classes)})
+        log_file, log_writer = open_train_log(log_path, start_epoch)
+        ckpt_writer = CheckpointWriter(cfg.checkpoint_dir, keep_last=cfg.keep_checkpoints)
 
-    patience_left = cfg.patience
+    def write_arch_meta():
+        # architecture sidecar (<weights>.json), written after the weights so old weights keep their own
+        save_arch_meta(best_path, cfg.model_name, len(cfg.classes), cfg.image_size, classes=list(cfg.classes),
+                       distilled_from=str(cfg.distill_from) if cfg.distill_from is not None else None)
 
-    for epoch in range(1, cfg.num_epochs + 1):
-        train_loss, train_acc = train_one_epoch(model, train_loader, criterion, optimizer, device)
-        val_loss, val_acc = eval_one_epoch(model, val_loader, criterion, device)
+    # RNG last, so sampler shuffles and worker seeds continue exactly where the checkpoint left off
+    if rng_state is not None:
+        restore_rng_state(rng_state)
 
-        with log_path.open("a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([epoch, f"{train_loss:.6f}", f"{train_acc:.6f}", f"{val_loss:.6f}", f"{val_acc:.6f}"])
+    for epoch in range(start_epoch, cfg.num_epochs + 1):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)  # reshuffle shards every epoch
+        if streaming:
+            train_ds.set_epoch(epoch)
+        t0 = time.perf_counter()
+        train_loss, train_acc = train_one_epoch(step_model, train_loader, train_criterion, optimizer, device,
+                                                train_batch_tf, amp_dtype=amp_dtype, scaler=scaler,
+                                                channels_last=cfg.channels_last, non_blocking=cfg.non_blocking,
+                                                log_every=cfg.log_every, teacher=teacher)
+        t1 = time.perf_counter()
+        val_loss, val_acc = eval_one_epoch(step_model, val_loader, criterion, device, val_batch_tf,
+                                           amp_dtype=amp_dtype, channels_last=cfg.channels_last,
+                                           non_blocking=cfg.non_blocking, log_every=cfg.log_every)
+        t2 = time.perf_counter()
 
-        print(f"Epoch {epoch}/{cfg.num_epochs} | train_acc={train_acc:.3f} val_acc={val_acc:.3f}")
+        # images/sec per phase (includes data loading), all ranks together
+        ranks = dist_info.world_size if streaming else 1  # streaming len() is per rank
+        train_ips = len(train_ds) * ranks / max(t1 - t0, 1e-9)
+        val_ips = len(val_ds) * ranks / max(t2 - t1, 1e-9)
 
-        if val_acc > best_val_acc:
+        # train/val metrics are already all-reduced, so every rank sees the same val_acc
+        improved = val_acc > best_val_acc
+        if improved:
             best_val_acc = val_acc
-            torch.save(model.state_dict(), best_path)
             patience_left = cfg.patience
-            print(f"  Saved best -> {best_path} (val_acc={best_val_acc:.3f})")
         else:
             patience_left -= 1
-            if patience_left <= 0:
+
+        rngs = gather_objects(capture_rng_state())  # collective: every rank takes part
+        if main_rank:
+            log_writer.writerow([epoch, f"{train_loss:.6f}", f"{train_acc:.6f}", f"{val_loss:.6f}", f"{val_acc:.6f}",
+                                 f"{train_ips:.1f}", f"{val_ips:.1f}"])
+            log_file.flush()
+
+            print(f"Epoch {epoch}/{cfg.num_epochs} | train_acc={train_acc:.3f} val_acc={val_acc:.3f} "
+                  f"| train {train_ips:.1f} img/s, val {val_ips:.1f} img/s")
+
+            if improved:
+                ckpt_writer.submit(best_path, model.state_dict(), after=write_arch_meta)
+                print(f"  Saved best -> {best_path} (val_acc={best_val_acc:.3f})")
+            ckpt_writer.save_epoch(epoch, {
+                "epoch": epoch,
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "scaler": scaler.state_dict() if scaler is not None else None,
+                "best_val_acc": best_val_acc,
+                "patience_left": patience_left,
+                "rng": rngs,
+                "model_name": cfg.model_name,
+                "classes": list(cfg.classes),
+            })
+
+        # rank 0's decision is authoritative so no rank can block in a collective alone
+        if broadcast_flag(patience_left <= 0, device):
+            if main_rank:
                 print("Early stopping.")
-                break
-
-    # write summary
-    save_json(cfg.metrics_dir / "metrics.json", {
-        "best_val_acc": best_val_acc,
-        "model_name": cfg.model_name,
-        "image_size": cfg.image_size,
-        "classes": list(cfg.classes),
-    })
-
-    print("Done. Next: run eval to produce confusion matrix if you want.")
-    print("Tip: integrate using inference/predict.py")
+            break
+
+    if main_rank:
+        log_file.close()
+        ckpt_writer.close()  # waits for pending writes
+
+        # write summary
+        save_json(cfg.metrics_dir / "metrics.json", {
+            "best_val_acc": best_val_acc,
+            "model_name": cfg.model_name,
+            "weights": str(best_path),
+            "distilled_from": str(cfg.distill_from) if cfg.distill_from is not None else None,
+            "image_size": cfg.image_size,
+            "classes": list(cfg.classes),
+            "world_size": dist_info.world_size,
+        })
+
+        print("Done. Next: run eval to produce confusion matrix if you want.")
+        print("Tip: integrate using inference/predict.py")
+    cleanup()
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,11 @@
+import contextlib
+import functools
 import json
 import random
+import time
+import warnings
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 import numpy as np
 import torch
@@ -28,3 +32,80 @@ def get_device(preferred: str = "cuda") -> torch.device:
     if preferred == "cuda" and torch.cuda.is_available():
         return torch.device("cuda")
     return torch.device("cpu")
+
+# --- Speed switches (autocast / channels_last / torch.compile) with clean fallback ---
+
+_AMP_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+@functools.lru_cache(maxsize=None)
+def resolve_amp_dtype(name: Optional[str], device_type: str) -> Optional[torch.dtype]:
+    if not name:
+        return None
+    if name not in _AMP_DTYPES:
+        raise ValueError(f"Unknown amp_dtype {name!r}, expected one of {sorted(_AMP_DTYPES)}")
+    dtype = _AMP_DTYPES[name]
+    if device_type == "cuda" and dtype == torch.bfloat16 and not torch.cuda.is_bf16_supported():
+        print(f"autocast {name} not supported on this GPU; using fp32")
+        return None
+    # torch warns and disables autocast for unsupported (device, dtype) pairs
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            with torch.autocast(device_type=device_type, dtype=dtype):
+                pass
+        except RuntimeError:
+            caught.append(None)
+    if caught:
+        print(f"autocast {name} not supported on {device_type}; using fp32")
+        return None
+    return dtype
+
+def autocast(device, dtype: Optional[torch.dtype]):
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+def make_grad_scaler(device, dtype: Optional[torch.dtype]):
+    # loss scaling is only needed for fp16 on CUDA
+    if dtype != torch.float16 or torch.device(device).type != "cuda":
+        return None
+    if hasattr(torch.amp, "GradScaler"):
+        return torch.amp.GradScaler("cuda")
+    return torch.cuda.amp.GradScaler()
+
+def maybe_compile(model: torch.nn.Module, mode: Optional[str], example: torch.Tensor) -> torch.nn.Module:
+    """torch.compile `model`, or return it unchanged if compiling fails (checked with one warm-up call)."""
+    if not mode:
+        return model
+    if not hasattr(torch, "compile"):
+        print("torch.compile not available; using eager model")
+        return model
+    was_training = model.training
+    try:
+        compiled = torch.compile(model, mode=mode)
+        model.eval()
+        with torch.no_grad():
+            compiled(example)
+    except Exception as e:  # missing compiler toolchain, unsupported platform, ...
+        print(f"torch.compile failed ({type(e).__name__}: {e}); using eager model")
+        return model
+    finally:
+        model.train(was_training)
+    return compiled
+
+@torch.no_grad()
+def measure_latency(model, image_size: int, batch_size: int = 1, warmup: int = 5, iters: int = 50) -> dict:
+    x = torch.randn(batch_size, 3, image_size, image_size)
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        model(x)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return {
+        "batch_size": batch_size,
+        "mean_ms": float(np.mean(times)),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p90_ms": float(np.percentile(times, 90)),
+    }
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import torch
+from torch.utils.data import DataLoader
+
+from .config import Config
+from .eval import SPLITS, compute_logits, file_hash, load_cached_logits, logits_meta, save_cached_logits
+from .model import BACKBONES, create_model, load_finetuned, read_arch_meta, resolve_model_name
+from .train import load_splits, loader_kwargs, make_dataset
+from .utils import ensure_dir, load_json, measure_latency, save_json
+
+# Latency / accuracy table per backbone, to pick the cheapest model that is still accurate enough:
+#   python -m src.ml.zoo                                  # models/*.pth with a sidecar + every architecture
+#   python -m src.ml.zoo --weights models/model.pth models/model_mobilenet_v3_small.pth --max-acc-drop 0.01
+# Accuracy comes from eval's logits cache (one forward pass per checkpoint and split, ever).
+
+def default_weights(models_dir: Path) -> List[Path]:
+    # legacy models/model.pth has no sidecar but is the resnet18 baseline
+    return [p for p in sorted(models_dir.glob("*.pth")) if read_arch_meta(p) or p.name == "model.pth"]
+
+def param_count(model: torch.nn.Module) -> int:
+    return sum(p.numel() for p in model.parameters())
+
+def split_accuracy(model, weights: Path, model_name: str, split: str, samples, classes: Sequence[str],
+                   cfg: Config, logits_dir: Path) -> float:
+    cpu = torch.device("cpu")
+    ckpt_hash = file_hash(weights)
+    meta = logits_meta(ckpt_hash, split, samples, classes, model_name, cfg, cpu)
+    key = f"{ckpt_hash}_{split}"
+    cached = load_cached_logits(logits_dir, key, meta)
+    if cached is None:
+        ds = make_dataset(cfg, samples, split, train=False)
+        loader = DataLoader(ds, shuffle=False, **loader_kwargs(cfg, cpu))
+        logits, y = compute_logits(model, loader, cpu, cfg, len(ds), len(classes))
+        save_cached_logits(logits_dir, key, meta, logits, y)
+    else:
+        logits, y = cached
+    return float((logits.argmax(axis=1) == y).mean()) if len(y) else 0.0
+
+def pick_within_budget(rows: List[Dict[str, Any]], max_acc_drop: float) -> Dict[str, Any] | None:
+    """Fastest trained model whose accuracy is within `max_acc_drop` of the best one."""
+    scored = [r for r in rows if r["accuracy"] is not None]
+    if not scored:
+        return None
+    best = max(r["accuracy"] for r in scored)
+    ok = [r for r in scored if r["accuracy"] >= best - max_acc_drop]
+    return min(ok, key=lambda r: r["latency"]["mean_ms"])
+
+def main():
+    cfg = Config()
+    parser = argparse.ArgumentParser(description="Latency/accuracy table per backbone (CPU).")
+    parser.add_argument("--weights", type=Path, nargs="*", default=None,
+                        help="trained checkpoints (default: models/*.pth that have an architecture sidecar)")
+    parser.add_argument("--split", default="val", choices=SPLITS)
+    parser.add_argument("--archs", nargs="*", default=sorted(BACKBONES),
+                        help="untrained architectures to time as well (latency only)")
+    parser.add_argument("--latency-only", action="store_true", help="skip the accuracy pass")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--max-acc-drop", type=float, default=0.01,
+                        help="accuracy budget for picking the fastest model, absolute")
+    parser.add_argument("--logits-dir", type=Path, default=cfg.metrics_dir / "logits")
+    args = parser.parse_args()
+
+    weights_list = args.weights if args.weights is not None else default_weights(cfg.output_dir)
+    classes = load_json(cfg.output_dir / "labels.json")["classes"] if weights_list else list(cfg.classes)
+    samples = None
+    if weights_list and not args.latency_only:
+        samples = dict(zip(SPLITS, load_splits(cfg, tuple(classes))))[args.split]
+
+    rows: List[Dict[str, Any]] = []
+    timed = set()
+    for weights in weights_list:
+        model_name = resolve_model_name(weights, cfg.model_name)
+        model = load_finetuned(model_name, len(classes), weights, device="cpu")
+        acc = None
+        if samples is not None:
+            acc = split_accuracy(model, weights, model_name, args.split, samples, classes, cfg, args.logits_dir)
+        rows.append({"name": weights.name, "model_name": model_name, "weights": str(weights),
+                     "distilled_from": read_arch_meta(weights).get("distilled_from"),
+                     "params_m": param_count(model) / 1e6, "size_mb": weights.stat().st_size / 1e6,
+                     "accuracy": acc, "latency": measure_latency(model, cfg.image_size, args.batch_size)})
+        timed.add(model_name)
+
+    for name in args.archs:
+        if name in timed:
+            continue
+        model = create_model(name, len(classes), pretrained=False).eval()
+        rows.append({"name": f"({name})", "model_name": name, "weights": None, "distilled_from": None,
+                     "params_m": param_count(model) / 1e6, "size_mb": None, "accuracy": None,
+                     "latency": measure_latency(model, cfg.image_size, args.batch_size)})
+
+    rows.sort(key=lambda r: r["latency"]["mean_ms"])
+    pick = pick_within_budget(rows, args.max_acc_drop)
+
+    print(f"CPU latency, batch {args.batch_size}, {torch.get_num_threads()} threads, "
+          f"{cfg.image_size}px; accuracy on {args.split}")
+    print(f"{'model':36s} {'arch':20s} {'params':>8s} {'mean ms':>8s} {'p90 ms':>8s} {'acc':>7s}")
+    for r in rows:
+        acc = f"{r['accuracy']:.4f}" if r["accuracy"] is not None else "-"
+        mark = "  <- pick" if pick is r else ""
+        print(f"{r['name']:36s} {r['model_name']:20s} {r['params_m']:7.2f}M "
+              f"{r['latency']['mean_ms']:8.1f} {r['latency']['p90_ms']:8.1f} {acc:>7s}{mark}")
+
+    ensure_dir(cfg.metrics_dir)
+    out = cfg.metrics_dir / "zoo.json"
+    save_json(out, {"split": args.split, "batch_size": args.batch_size, "image_size": cfg.image_size,
+                    "num_threads": torch.get_num_threads(), "max_acc_drop": args.max_acc_drop,
+                    "pick": pick["name"] if pick is not None else None, "rows": rows})
+    print("Saved:", out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import json
+
+import torch
+import torch.nn as nn
+from torchvision.models import quantization as qmodels
+
+from inference.api import load_model
+from inference.backends import resolve_backend
+from src.ml.quantize import default_engine, quantize_static, save_quantized
+
+CLASSES = ["cardboard", "glass", "metal", "paper", "plastic", "trash"]
+IMAGE_SIZE = 64
+
+
+def _quantize_output(tmp_path):
+    # same path as `python -m src.ml.quantize`, on random weights and calibration data
+    m = qmodels.resnet18(weights=None, quantize=False)
+    m.fc = nn.Linear(m.fc.in_features, len(CLASSES))
+    calib = [(torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE), torch.zeros(2, dtype=torch.long))]
+    qmodel = quantize_static(m.eval(), calib, None, default_engine(), num_batches=1)
+    out = tmp_path / "model_int8.pt"
+    save_quantized(qmodel, out, {"quantized": True, "engine": default_engine(), "classes": CLASSES}, IMAGE_SIZE)
+    labels = tmp_path / "labels.json"
+    labels.write_text(json.dumps({"classes": CLASSES}), encoding="utf-8")
+    return out, labels
+
+
+def test_torchscript_backend_loads_int8_artifact(tmp_path):
+    weights, labels = _quantize_output(tmp_path)
+    assert resolve_backend(weights, "torchscript") == ("torchscript", weights)
+
+    model, classes, device = load_model(weights, labels, device="cpu", backend="torchscript")
+    assert classes == CLASSES and device == "cpu"
+    with torch.no_grad():
+        logits = model(torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+    assert logits.shape == (1, len(CLASSES))